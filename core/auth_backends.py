@@ -0,0 +1,25 @@
+from django.contrib.auth.backends import ModelBackend
+
+from user.models import User
+
+
+class EmailBackend(ModelBackend):
+    """
+    ModelBackend for the login path: the user is looked up by email ignoring
+    case, through the user_email_ci_unique index (User.objects.by_email), and
+    only User.LOGIN_FIELDS are loaded.
+    """
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None:
+            email = kwargs.get(User.USERNAME_FIELD)
+        if email is None or password is None:
+            return None
+        user = User._default_manager.by_email(email).only(*User.LOGIN_FIELDS).first()
+        if user is None:
+            # Hash anyway so that unknown emails take as long as wrong
+            # passwords, as ModelBackend does.
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,174 @@
+"""
+Per-process PostgreSQL connection pool, used through the `core.db_pool`
+database ENGINE (see core/db_pool/base.py).
+
+Django opens a connection per thread and closes it at the end of the request
+when CONN_MAX_AGE is 0. With this backend "opening" checks a connection out
+of the pool and "closing" checks it back in, so the TCP/TLS handshake and
+authentication are paid once per pooled connection rather than per request.
+
+Pool options live under the database's POOL key:
+
+    SIZE          most connections open at once in this process
+    MAX_LIFETIME  seconds after which a connection is closed instead of reused
+    HEALTH_CHECK  run SELECT 1 on a reused connection before handing it out
+    TIMEOUT       seconds to wait for a free connection before failing
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from psycopg2 import Error as DatabaseError
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS, TRANSACTION_STATUS_INERROR
+
+
+class ConnectionPool:
+    def __init__(self, size=10, max_lifetime=1800, health_check=True, timeout=10):
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+        self.timeout = timeout
+        self._idle = deque()
+        self._created_at = {}
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'checkouts': 0,
+            'reused': 0,
+            'opened': 0,
+            'closed': 0,
+            'health_check_failures': 0,
+            'timeouts': 0,
+            'wait_total': 0.0,
+        }
+
+    def checkout(self, connect):
+        """
+        Return an idle connection, or a new one made by calling `connect`.
+        """
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise OperationalError("connection pool exhausted (size %d)" % self.size)
+        try:
+            with self._lock:
+                self._stats['checkouts'] += 1
+                self._stats['wait_total'] += time.monotonic() - started
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    connection = connect()
+                    with self._lock:
+                        self._created_at[id(connection)] = time.monotonic()
+                        self._stats['opened'] += 1
+                    return connection
+                if self._expired(connection):
+                    self._discard(connection)
+                elif self.health_check and not self._healthy(connection):
+                    with self._lock:
+                        self._stats['health_check_failures'] += 1
+                    self._discard(connection)
+                else:
+                    with self._lock:
+                        self._stats['reused'] += 1
+                    return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def checkin(self, connection):
+        try:
+            status = connection.info.transaction_status if not connection.closed else None
+            if status in (TRANSACTION_STATUS_INTRANS, TRANSACTION_STATUS_INERROR):
+                connection.rollback()
+                status = connection.info.transaction_status
+            if status == TRANSACTION_STATUS_IDLE and not connection.autocommit:
+                # A connection closed inside atomic() comes back with
+                # autocommit off: the health check's SELECT 1 would then
+                # leave it in a transaction, and Django's set_autocommit(True)
+                # on the next checkout would fail.
+                connection.autocommit = True
+            if status != TRANSACTION_STATUS_IDLE or self._expired(connection):
+                self._discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append(connection)
+        except DatabaseError:
+            self._discard(connection)
+        finally:
+            self._slots.release()
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for connection in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                size=self.size,
+                idle=len(self._idle),
+                open=len(self._created_at),
+                in_use=len(self._created_at) - len(self._idle),
+            )
+
+    def _expired(self, connection):
+        created_at = self._created_at.get(id(connection))
+        return created_at is None or time.monotonic() - created_at > self.max_lifetime
+
+    def _healthy(self, connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except DatabaseError:
+            return False
+
+    def _discard(self, connection):
+        with self._lock:
+            self._created_at.pop(id(connection), None)
+            self._stats['closed'] += 1
+        try:
+            connection.close()
+        except DatabaseError:
+            pass
+
+
+_pools = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    global _pools, _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Forked worker: the parent's connections cannot be shared.
+            _pools, _pools_pid = {}, os.getpid()
+        if alias not in _pools:
+            config = settings_dict.get('POOL', {})
+            _pools[alias] = ConnectionPool(
+                size=config.get('SIZE', 10),
+                max_lifetime=config.get('MAX_LIFETIME', 1800),
+                health_check=config.get('HEALTH_CHECK', True),
+                timeout=config.get('TIMEOUT', 10),
+            )
+        return _pools[alias]
+
+
+def pool_stats():
+    """
+    Statistics of every pool in this process, keyed by database alias.
+    """
+    with _pools_lock:
+        pools = dict(_pools) if _pools_pid == os.getpid() else {}
+    return {alias: pool.stats() for alias, pool in pools.items()}
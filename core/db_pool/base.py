@@ -0,0 +1,25 @@
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from . import get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The stock PostgreSQL backend, except that connections come from and go
+    back to the process-wide pool in `core.db_pool`.
+    """
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict)
+        connection = pool.checkout(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        # A reused connection skipped the parent's get_new_connection, which
+        # is where the isolation level is normally recorded.
+        self.isolation_level = IsolationLevel(
+            self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED)
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            get_pool(self.alias, self.settings_dict).checkin(self.connection)
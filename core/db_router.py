@@ -0,0 +1,120 @@
+"""
+Database router sending the reads of safe-method requests (GET, HEAD,
+OPTIONS) to the read replicas in REPLICAS['ALIASES'], and everything else to
+the primary ('default').
+
+What a request may read from is decided by core.middleware.ReplicaRoutingMiddleware
+and kept in a context variable, so it follows the request across
+sync_to_async/async_to_sync hops. Outside a request (management commands,
+shells, tests) every query goes to the primary.
+
+A request reads from one replica, picked at its first read, so that all of
+its reads see the same point in time however far each replica lags.
+
+Read-your-writes: a request that writes makes every later query of that
+request go to the primary, and the user who made it reads from the primary
+for the next REPLICAS['STICKY_SECONDS'], by which time the replicas have
+caught up. The sticky users are kept in the REPLICAS['CACHE'] cache, which
+has to be a shared backend for the stickiness to hold across processes.
+
+Reads that fill a cache (the auth user cache, the organisation cache) run
+under `use_primary()`, so a lagging replica cannot put an old row back into
+a cache that a write has just invalidated.
+"""
+
+import contextlib
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+PRIMARY = 'default'
+
+_current = contextvars.ContextVar('replica_routing', default=None)
+_forced_primary = contextvars.ContextVar('replica_routing_forced_primary', default=False)
+
+
+class RoutingState:
+    def __init__(self, use_replicas):
+        self.use_replicas = use_replicas
+        self.wrote = False
+        # The replica this request reads from, once it has read.
+        self.replica = None
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def routing(use_replicas):
+    """
+    Route the queries made inside the block, reading from the replicas only
+    when `use_replicas` is true. The block is handed the RoutingState.
+    """
+    state = RoutingState(use_replicas)
+    with resume(state):
+        yield state
+
+
+@contextlib.contextmanager
+def resume(state):
+    """
+    Route the queries made inside the block with the RoutingState of a
+    request again, for the content of a streaming response, which is
+    produced after `routing()` has exited.
+    """
+    reset = _current.set(state)
+    try:
+        yield
+    finally:
+        _current.reset(reset)
+
+
+@contextlib.contextmanager
+def use_primary():
+    reset = _forced_primary.set(True)
+    try:
+        yield
+    finally:
+        _forced_primary.reset(reset)
+
+
+def _sticky_key(user_id):
+    return f'replica-sticky:{user_id}'
+
+
+def stick(user_id):
+    """
+    Send the reads of `user_id` to the primary for REPLICAS['STICKY_SECONDS'].
+    """
+    config = settings.REPLICAS
+    if config['ALIASES'] and config['STICKY_SECONDS'] > 0:
+        caches[config['CACHE']].set(_sticky_key(user_id), True, config['STICKY_SECONDS'])
+
+
+def is_sticky(user_id):
+    return caches[settings.REPLICAS['CACHE']].get(_sticky_key(user_id)) is not None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None or not state.use_replicas or _forced_primary.get():
+            return PRIMARY
+        if state.replica is None:
+            state.replica = random.choice(settings.REPLICAS['ALIASES'])
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+            state.use_replicas = False
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
@@ -1,12 +1,12 @@
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
-from .exceptions import NoTokenError, AuthenticationFailed
+from .exceptions import NoTokenError, AuthenticationFailed, HashingBusyError
 
 
 def custom_exception_handler(exc, context):
     response = exception_handler(exc, context)
 
-    if isinstance(exc, (AuthenticationFailed, NoTokenError)):
+    if isinstance(exc, (AuthenticationFailed, NoTokenError, HashingBusyError)):
         return Response(exc.default_detail, status=exc.status_code)
 
     return response
@@ -14,8 +14,33 @@ class NoTokenError(exceptions.APIException):
     default_code = 'no_token'
 
 
+class HashingBusyError(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = {
+        "status": "Service unavailable",
+        "message": "Too many requests are being processed, please retry",
+        "statusCode": 503
+    }
+    default_code = 'hashing_busy'
+
+
 class IsAuthenticatedCustom(BasePermission):
     def has_permission(self, request, view):
         if not request.user or not request.user.is_authenticated:
             raise NoTokenError()
         return True
+
+
+class IsAuthenticatedExceptPostCustom(IsAuthenticatedCustom):
+    """
+    IsAuthenticatedCustom for every method but POST, for views whose POST
+    has always been open and that later gained a GET.
+    """
+    def has_permission(self, request, view):
+        return request.method == 'POST' or super().has_permission(request, view)
+
+
+class IsAdminCustom(IsAuthenticatedCustom):
+    def has_permission(self, request, view):
+        super().has_permission(request, view)
+        return bool(request.user.is_staff)
@@ -0,0 +1,218 @@
+"""
+Runs password hashing on a worker pool instead of the request thread.
+
+PBKDF2 costs tens of milliseconds per call. Handing it to a bounded pool keeps
+a burst of logins or registrations from holding every request thread, and
+requests that would have to wait longer than PASSWORD_HASHING['QUEUE_TIMEOUT']
+for a slot are turned away with a 503 instead of piling up.
+
+The executor is chosen with PASSWORD_HASHING['EXECUTOR']:
+
+    inline   hash on the calling thread (still measured)
+    thread   thread pool, enough for hashers that release the GIL (PBKDF2 does)
+    process  process pool, for pure-Python hashers
+"""
+
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from . import metrics, timing
+from .exceptions import HashingBusyError
+
+
+def _init_process_worker():
+    # Process workers are spawned so they never inherit the parent's database
+    # connections; Django has to be set up again for the hasher settings.
+    django.setup()
+
+
+def _timed_call(fn, *args):
+    started = time.time()
+    result = fn(*args)
+    return started, time.time(), result
+
+
+class HashingExecutor:
+    def __init__(self, kind='thread', workers=4, max_queue=64, queue_timeout=2.0):
+        if kind not in ('inline', 'thread', 'process'):
+            raise ValueError(f"Unknown password hashing executor {kind!r}")
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'rejected': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'hash_time_total': 0.0,
+        }
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'PASSWORD_HASHING', {})
+        return cls(
+            kind=config.get('EXECUTOR', 'thread'),
+            workers=config.get('WORKERS', 4),
+            max_queue=config.get('MAX_QUEUE', 64),
+            queue_timeout=config.get('QUEUE_TIMEOUT', 2.0),
+        )
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.kind == 'process':
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_process_worker,
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='password-hashing')
+            return self._executor
+
+    def run(self, fn, *args):
+        """
+        Call fn(*args) on the pool and wait for the result. Raises
+        HashingBusyError when no slot frees up within the queue timeout.
+        """
+        if self.kind == 'inline':
+            submitted = time.time()
+            started, finished, result = _timed_call(fn, *args)
+        else:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                self._reject()
+            try:
+                submitted = time.time()
+                started, finished, result = self._get_executor().submit(_timed_call, fn, *args).result()
+            finally:
+                self._slots.release()
+
+        self._record(submitted, started, finished)
+        return result
+
+    def map(self, fn, items):
+        """
+        [fn(item) for item in items], spread over the pool. Every call takes a
+        slot as `run` does, so a large batch queues with, and is bounded like,
+        every other caller, and HashingBusyError is raised when a slot does
+        not free up within the queue timeout.
+        """
+        if self.kind == 'inline':
+            return [self.run(fn, item) for item in items]
+
+        futures = []
+        try:
+            for item in items:
+                if not self._slots.acquire(timeout=self.queue_timeout):
+                    self._reject()
+                submitted = time.time()
+                try:
+                    future = self._get_executor().submit(_timed_call, fn, item)
+                except BaseException:
+                    self._slots.release()
+                    raise
+                future.add_done_callback(lambda _: self._slots.release())
+                futures.append((submitted, future))
+        except BaseException:
+            for _, future in futures:
+                future.cancel()
+            raise
+
+        results = []
+        for submitted, future in futures:
+            started, finished, result = future.result()
+            self._record(submitted, started, finished)
+            results.append(result)
+        return results
+
+    async def arun(self, fn, *args):
+        """
+        Same as `run`, but awaits the pool instead of blocking, for async views.
+        """
+        if self.kind == 'inline':
+            return self.run(fn, *args)
+
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            acquired = await asyncio.to_thread(self._slots.acquire, timeout=self.queue_timeout)
+        if not acquired:
+            self._reject()
+        try:
+            submitted = time.time()
+            future = self._get_executor().submit(_timed_call, fn, *args)
+            started, finished, result = await asyncio.wrap_future(future)
+        finally:
+            self._slots.release()
+
+        self._record(submitted, started, finished)
+        return result
+
+    def _reject(self):
+        with self._lock:
+            self._stats['rejected'] += 1
+        raise HashingBusyError()
+
+    def _record(self, submitted, started, finished):
+        queue_wait = max(0.0, started - submitted)
+        # The request waited for the queue as well as for the hash itself.
+        timing.add('hash', queue_wait + finished - started)
+        metrics.registry.observe('password_hash_duration_seconds', queue_wait + finished - started)
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['queue_wait_total'] += queue_wait
+            self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], queue_wait)
+            self._stats['hash_time_total'] += finished - started
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, executor=self.kind, workers=self.workers, max_queue=self.max_queue)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+executor = HashingExecutor.from_settings()
+
+
+def make_password(password):
+    return executor.run(hashers.make_password, password)
+
+
+def check_password(password, encoded):
+    return executor.run(hashers.check_password, password, encoded)
+
+
+async def amake_password(password):
+    return await executor.arun(hashers.make_password, password)
+
+
+async def acheck_password(password, encoded):
+    return await executor.arun(hashers.check_password, password, encoded)
+
+
+def must_update(encoded):
+    """
+    Whether a correct password's stored hash should be upgraded to the current
+    preferred hasher or iteration count.
+    """
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False
+    preferred = hashers.get_hasher('default')
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
@@ -0,0 +1,44 @@
+"""
+Time-ordered UUIDs (version 7, RFC 9562) for primary keys.
+
+The first 48 bits are the Unix time in milliseconds, so keys generated later
+sort later: new rows land at the right-hand edge of the primary key index
+instead of on a random leaf page, and ordering by primary key is ordering by
+creation time. The next 12 bits are a counter, so keys generated within the
+same millisecond by one process still sort in generation order (RFC 9562,
+method 1); the last 62 bits are random.
+"""
+
+import os
+import threading
+import time
+import uuid
+
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def uuid7():
+    global _last_ms, _counter
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _last_ms:
+            # Start each millisecond at a random counter value below the
+            # midpoint, leaving room to count up.
+            _counter = int.from_bytes(os.urandom(2), 'big') & 0x7ff
+        else:
+            # Same millisecond, or the clock went backwards: keep counting
+            # from the last key, moving into the next millisecond once the
+            # counter is used up.
+            ms = _last_ms
+            _counter += 1
+            if _counter > 0xfff:
+                ms += 1
+                _counter = 0
+        _last_ms = ms
+        counter = _counter
+
+    random = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    return uuid.UUID(int=(ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | random)
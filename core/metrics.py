@@ -0,0 +1,290 @@
+"""
+In-process metrics, served in the Prometheus text format at /metrics.
+
+Request latencies and password-hash durations are recorded into fixed-bucket
+histograms as they happen; the auth user cache, hashing executor and
+connection pool statistics are read from those components when /metrics is
+scraped.
+
+Recording takes no lock: every thread writes to its own shard, and a scrape
+sums the shards. When a thread ends its shard is folded into a shared total,
+so threads that come and go do not leave shards behind. With
+METRICS['MULTIPROCESS_DIR'] set, each process also dumps its totals to a file
+in that directory (at most every METRICS['FLUSH_INTERVAL'] seconds, and on
+every scrape), and a scrape of any worker sums the files of all of them, so
+every gunicorn worker reports the whole server. The files of workers that
+have exited are folded into an archive file by the next scrape: their
+counters and histograms keep counting, their gauges are dropped.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+HISTOGRAM = 'histogram'
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+# name -> (type, help)
+FAMILIES = {
+    'http_request_duration_seconds': (HISTOGRAM, "Request latency by URL name"),
+    'http_errors_total': (COUNTER, "Responses with a 4xx or 5xx status, by URL name and status code"),
+    'password_hash_duration_seconds': (HISTOGRAM, "Password hash time, including the wait for a pool slot"),
+    'password_hash_rejected_total': (COUNTER, "Password hashes turned away because the hashing queue was full"),
+    'auth_user_cache_hits_total': (COUNTER, "Authenticated users served from the user cache"),
+    'auth_user_cache_misses_total': (COUNTER, "Authenticated users not found in the user cache"),
+    'auth_user_cache_size': (GAUGE, "Users held in the user cache"),
+    'organisation_cache_hits_total': (COUNTER, "Organisation cache hits, by endpoint and cache"),
+    'organisation_cache_misses_total': (COUNTER, "Organisation cache misses, by endpoint and cache"),
+    'db_pool_checkouts_total': (COUNTER, "Connections checked out of the pool"),
+    'db_pool_reused_total': (COUNTER, "Checkouts served by an idle connection"),
+    'db_pool_opened_total': (COUNTER, "Connections opened by the pool"),
+    'db_pool_closed_total': (COUNTER, "Connections closed by the pool"),
+    'db_pool_health_check_failures_total': (COUNTER, "Idle connections that failed their health check"),
+    'db_pool_timeouts_total': (COUNTER, "Checkouts that timed out waiting for a connection"),
+    'db_pool_wait_seconds_total': (COUNTER, "Time spent waiting for a free connection"),
+    'db_pool_open_connections': (GAUGE, "Connections currently open"),
+    'db_pool_in_use_connections': (GAUGE, "Connections currently checked out"),
+}
+
+
+ARCHIVE = 'archive.json'
+
+
+class _ThreadToken:
+    """
+    Held only by a thread's threading.local, so it is released when the
+    thread ends.
+    """
+
+
+class Registry:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = {}
+        # Samples of threads that have ended.
+        self._retired = defaultdict(float)
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # Registering a thread's shard is the only locked step.
+            shard = self._local.shard = defaultdict(float)
+            token = self._local.token = _ThreadToken()
+            with self._lock:
+                self._shards[id(token)] = shard
+            weakref.finalize(token, self._retire, id(token))
+        return shard
+
+    def _retire(self, key):
+        with self._lock:
+            shard = self._shards.pop(key)
+            for sample, value in shard.items():
+                self._retired[sample] += value
+
+    def inc(self, name, labels=(), value=1):
+        self._shard()[(name, labels, None)] += value
+
+    def observe(self, name, value, labels=()):
+        """
+        Record `value` in the histogram `name`. Bucket counts are kept
+        per bucket and only made cumulative when rendered.
+        """
+        shard = self._shard()
+        for bound in BUCKETS:
+            if value <= bound:
+                shard[(name, labels, bound)] += 1
+                break
+        shard[(name, labels, 'sum')] += value
+        shard[(name, labels, 'count')] += 1
+
+    def collect(self):
+        """
+        This process's samples: the shards summed, plus the statistics read
+        from the cache, the hashing executor and the connection pools.
+        """
+        with self._lock:
+            shards = list(self._shards.values())
+            samples = self._retired.copy()
+        for shard in shards:
+            # dict.copy() runs without releasing the GIL, so it is safe while
+            # the owning thread keeps writing.
+            for key, value in shard.copy().items():
+                samples[key] += value
+        for name, labels, value in _component_samples():
+            samples[(name, labels, None)] += value
+        return samples
+
+    def flush(self, force=False):
+        """
+        Dump this process's samples to METRICS['MULTIPROCESS_DIR'], if set.
+        """
+        directory = settings.METRICS['MULTIPROCESS_DIR']
+        now = time.monotonic()
+        if not directory or (not force and now - self._last_flush < settings.METRICS['FLUSH_INTERVAL']):
+            return
+        self._last_flush = now
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        _write(Path(directory) / f'{os.getpid()}.json', self.collect())
+
+    def gather(self):
+        """
+        The samples to report: this process's, or every process's when a
+        multiprocess directory is configured.
+        """
+        directory = settings.METRICS['MULTIPROCESS_DIR']
+        if not directory:
+            return self.collect()
+        self.flush(force=True)
+        directory = Path(directory)
+        samples = defaultdict(float)
+        with _locked(directory):
+            _archive_exited(directory)
+            for path in directory.glob('*.json'):
+                for key, value in _read(path):
+                    samples[key] += value
+        return samples
+
+
+@contextlib.contextmanager
+def _locked(directory):
+    """
+    Serialise the scrapes of all workers, so that a file being archived is
+    never summed twice or not at all.
+    """
+    with open(directory / 'lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _archive_exited(directory):
+    """
+    Fold the files of workers that have exited into the archive file, leaving
+    out their gauges, which no longer describe anything.
+    """
+    exited = [path for path in directory.glob('*.json') if path.stem.isdigit() and not _alive(int(path.stem))]
+    if not exited:
+        return
+    archived = defaultdict(float, _read(directory / ARCHIVE))
+    for path in exited:
+        for key, value in _read(path):
+            if FAMILIES.get(key[0], (None,))[0] != GAUGE:
+                archived[key] += value
+    _write(directory / ARCHIVE, archived)
+    for path in exited:
+        path.unlink(missing_ok=True)
+
+
+def _read(path):
+    try:
+        rows = json.loads(path.read_text())
+    except (OSError, ValueError):
+        # Missing, or half-written by another worker; it is read again on
+        # the next scrape.
+        return []
+    return [((name, tuple(tuple(label) for label in labels), suffix), value)
+            for name, labels, suffix, value in rows]
+
+
+def _write(path, samples):
+    rows = [[name, list(labels), suffix, value] for (name, labels, suffix), value in samples.items()]
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(rows, f)
+    os.replace(tmp, path)
+
+
+def _component_samples():
+    from .hashing import executor
+    from .user_cache import user_cache
+
+    cache = user_cache.stats()
+    yield 'auth_user_cache_hits_total', (), cache['hits']
+    yield 'auth_user_cache_misses_total', (), cache['misses']
+    yield 'auth_user_cache_size', (), cache['size']
+    yield 'password_hash_rejected_total', (), executor.stats()['rejected']
+
+    if settings.DB_CONNECTION_MODE == 'pool':
+        from .db_pool import pool_stats
+        for alias, stats in pool_stats().items():
+            labels = (('alias', alias),)
+            for key in ('checkouts', 'reused', 'opened', 'closed', 'health_check_failures', 'timeouts'):
+                yield f'db_pool_{key}_total', labels, stats[key]
+            yield 'db_pool_wait_seconds_total', labels, stats['wait_total']
+            yield 'db_pool_open_connections', labels, stats['open']
+            yield 'db_pool_in_use_connections', labels, stats['in_use']
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render(samples):
+    by_family = defaultdict(lambda: defaultdict(dict))
+    for (name, labels, suffix), value in samples.items():
+        by_family[name][labels][suffix] = value
+
+    lines = []
+    for name, (kind, help_text) in FAMILIES.items():
+        series = by_family.get(name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels in sorted(series):
+            values = series[labels]
+            if kind != HISTOGRAM:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(values[None])}')
+                continue
+            cumulative = 0
+            for bound in BUCKETS:
+                cumulative += values.get(bound, 0)
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {_format_value(cumulative)}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(values.get("sum", 0))}')
+            lines.append(f'{name}_count{_format_labels(labels)} {_format_value(values.get("count", 0))}')
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    if not settings.METRICS['ENABLED']:
+        raise Http404
+    token = settings.METRICS['TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(render(registry.gather()), content_type='text/plain; version=0.0.4; charset=utf-8')
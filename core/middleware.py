@@ -0,0 +1,317 @@
+import cProfile
+import json
+import logging
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+
+from . import db_router, metrics, profiling, timing
+
+
+logger = logging.getLogger('core.timing')
+
+# Phases always reported, in Server-Timing order, besides db and total.
+PHASES = ('auth', 'hash', 'serialize')
+
+# cProfile hooks the whole interpreter, so only one request per process is
+# profiled at a time.
+_profiling_lock = threading.Lock()
+
+
+def _stream_within(response, context, on_close=None):
+    """
+    Have each chunk of a streaming response produced inside `context()`, so
+    the per-request state the queries behind the stream depend on is active
+    again while the response is sent, after the middleware has returned.
+    `on_close` is called once the content is exhausted or closed.
+    """
+    content = response.streaming_content
+
+    if response.is_async:
+        async def chunks():
+            try:
+                iterator = aiter(content)
+                while True:
+                    with context():
+                        try:
+                            chunk = await anext(iterator)
+                        except StopAsyncIteration:
+                            return
+                    yield chunk
+            finally:
+                if on_close is not None:
+                    on_close()
+    else:
+        def chunks():
+            try:
+                iterator = iter(content)
+                while True:
+                    with context():
+                        try:
+                            chunk = next(iterator)
+                        except StopIteration:
+                            return
+                    yield chunk
+            finally:
+                if on_close is not None:
+                    on_close()
+
+    response.streaming_content = chunks()
+
+
+class RequestTimingMiddleware:
+    """
+    Records, for every request, the number of queries, the time spent in the
+    database, in authentication, in password hashing and in rendering the
+    response. The breakdown is sent back in a Server-Timing header and logged
+    as one JSON line on the 'core.timing' logger.
+
+    Query shapes that repeat at least REQUEST_TIMING['N_PLUS_ONE_THRESHOLD']
+    times within one request are logged as a warning, since that is usually
+    a loop issuing one query per row.
+
+    A streaming response is timed until its content has been sent: its
+    Server-Timing header only covers the view, but the queries made while
+    streaming are counted in the log line and the N+1 check.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = settings.REQUEST_TIMING
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.header = config['SERVER_TIMING_HEADER']
+        self.log = config['LOG']
+        self.n_plus_one_threshold = config['N_PLUS_ONE_THRESHOLD']
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with timing.collect() as timings:
+            response = self.get_response(request)
+        self._finish(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        with timing.collect() as timings:
+            response = await self.get_response(request)
+        self._finish(request, response, timings)
+        return response
+
+    def _finish(self, request, response, timings):
+        if self.header:
+            total = timings.total()
+            metrics = [f'db;dur={timings.durations["db"] * 1000:.2f};desc="{timings.queries} queries"']
+            metrics += [f'{phase};dur={timings.durations[phase] * 1000:.2f}' for phase in PHASES]
+            metrics.append(f'total;dur={total * 1000:.2f}')
+            response['Server-Timing'] = ', '.join(metrics)
+        if response.streaming:
+            _stream_within(response, lambda: timing.resume(timings),
+                           on_close=lambda: self._report(request, response, timings))
+        else:
+            self._report(request, response, timings)
+
+    def _report(self, request, response, timings):
+        total = timings.total()
+        repeated = timings.repeated_queries(self.n_plus_one_threshold)
+        if repeated:
+            logger.warning(json.dumps({
+                'event': 'n_plus_one',
+                'method': request.method,
+                'path': request.path,
+                'view': self._view_name(request),
+                'queries': [{'sql': shape, 'count': count} for shape, count in repeated],
+            }))
+
+        if self.log:
+            logger.info(json.dumps({
+                'event': 'request',
+                'method': request.method,
+                'path': request.path,
+                'view': self._view_name(request),
+                'status': response.status_code,
+                'queries': timings.queries,
+                'db_ms': round(timings.durations['db'] * 1000, 2),
+                **{f'{phase}_ms': round(timings.durations[phase] * 1000, 2) for phase in PHASES},
+                'total_ms': round(total * 1000, 2),
+                'repeated_queries': len(repeated),
+            }))
+
+    @staticmethod
+    def _view_name(request):
+        match = getattr(request, 'resolver_match', None)
+        return match.view_name if match is not None else None
+
+
+class MetricsMiddleware:
+    """
+    Records every request's latency in the per-URL-name histogram of
+    core.metrics, and counts 4xx/5xx responses by URL name and status code.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started)
+        return response
+
+    def _record(self, request, response, latency):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else ''
+        metrics.registry.observe('http_request_duration_seconds', latency, (('view', view),))
+        if response.status_code >= 400:
+            metrics.registry.inc('http_errors_total', (('view', view), ('status', str(response.status_code))))
+        metrics.registry.flush()
+
+
+class ProfilingMiddleware:
+    """
+    Runs 1 in PROFILING['SAMPLE_RATE'] requests, and every request carrying a
+    valid signed PROFILING['HEADER'], under cProfile and stores the profile
+    with the endpoint name and latency (see core.profiling). Other requests
+    only pay for a random() call and a header lookup.
+
+    Only one request per process is profiled at a time: a request picked
+    while another is being profiled is served unprofiled, as is one picked
+    while some other profiler (a debugger, coverage) is active.
+
+    Async requests are always passed through unprofiled: cProfile only
+    follows the thread it was enabled on, which an async view shares with
+    every other request on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = settings.PROFILING
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.sample_rate = config['SAMPLE_RATE']
+        self.header = config['HEADER']
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            # Never profiled, see the class docstring.
+            return self.get_response(request)
+        if not self._wanted(request) or not _profiling_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is already active.
+                return self.get_response(request)
+            started = time.perf_counter()
+            try:
+                response = self.get_response(request)
+            finally:
+                profile.disable()
+            latency = time.perf_counter() - started
+        finally:
+            _profiling_lock.release()
+
+        match = getattr(request, 'resolver_match', None)
+        path = profiling.save(profile, match.view_name if match is not None else 'unresolved', latency)
+        logger.info(json.dumps({'event': 'profile', 'path': request.path, 'profile': str(path)}))
+        return response
+
+    def _wanted(self, request):
+        value = request.headers.get(self.header)
+        if value is not None:
+            return profiling.valid_debug_header(value)
+        return self.sample_rate > 0 and random.random() * self.sample_rate < 1
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets the reads of GET, HEAD and OPTIONS requests go to the read replicas
+    (see core.db_router), unless the user behind the request's token wrote
+    within the last REPLICAS['STICKY_SECONDS']. The user of a request that
+    wrote is made sticky once it has been handled. The reads made while a
+    streaming response is sent are routed like the rest of its request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        config = settings.REPLICAS
+        if not config['ALIASES']:
+            raise MiddlewareNotUsed()
+        if isinstance(caches[config['CACHE']], LocMemCache):
+            # Each worker would only see the writes it handled itself.
+            raise ImproperlyConfigured(
+                f"REPLICAS['CACHE'] ({config['CACHE']!r}) is a local-memory cache; read replicas need a cache "
+                "shared between processes to keep users who just wrote on the primary.")
+        from .custom_authentication import CustomUserJWTAuthentication
+        self.authentication = CustomUserJWTAuthentication()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with db_router.routing(self._use_replicas(request)) as state:
+            response = self.get_response(request)
+        self._finish(request, response, state)
+        return response
+
+    async def __acall__(self, request):
+        with db_router.routing(self._use_replicas(request)) as state:
+            response = await self.get_response(request)
+        self._finish(request, response, state)
+        return response
+
+    def _finish(self, request, response, state):
+        if response.streaming:
+            _stream_within(response, lambda: db_router.resume(state))
+        self._stick(request, state)
+
+    def _use_replicas(self, request):
+        if request.method not in self.SAFE_METHODS:
+            return False
+        user_id = self.authentication.token_user_id(request)
+        return user_id is None or not db_router.is_sticky(user_id)
+
+    def _stick(self, request, state):
+        user = getattr(request, 'user', None)
+        if state.wrote and user is not None and user.is_authenticated:
+            db_router.stick(user.pk)
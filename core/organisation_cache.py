@@ -0,0 +1,136 @@
+"""
+Cache of single-organisation payloads, keyed by orgId, and of whether a
+user is a member of an organisation, keyed by (orgId, userId), for
+GET /api/organisations/<orgId>.
+
+Membership is cached one flag per (organisation, user) pair rather than as
+the organisation's member set: a check then costs one small cache entry, and
+a miss one EXISTS query on the (organisation_id, user_id) index instead of
+loading every member of a large organisation.
+
+Entries live in the Django cache named by ORGANISATION_CACHE['ALIAS']: local
+memory by default, or any shared backend (Redis, Memcached, ...) configured
+under that alias in CACHES. Writes to an organisation or to its membership
+invalidate its entries through the signal receivers in `user.signals`.
+
+Misses are loaded from the primary database (see core.db_router), so that a
+lagging replica cannot refill an entry a write has just invalidated.
+
+Hits and misses are counted per endpoint and cache in core.metrics, as
+organisation_cache_hits_total and organisation_cache_misses_total.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import db_router, metrics
+
+
+class OrganisationCache:
+    def __init__(self, alias='organisations', ttl=300):
+        self.alias = alias
+        self.ttl = ttl
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'ORGANISATION_CACHE', {})
+        return cls(alias=config.get('ALIAS', 'organisations'), ttl=config.get('TTL', 300))
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _key(org_id):
+        return f'organisation:{org_id}'
+
+    @staticmethod
+    def _member_key(org_id, user_id):
+        return f'organisation-member:{org_id}:{user_id}'
+
+    def _record(self, endpoint, cache, hit):
+        name = 'organisation_cache_hits_total' if hit else 'organisation_cache_misses_total'
+        metrics.registry.inc(name, (('endpoint', endpoint), ('cache', cache)))
+
+    def organisation(self, org_id, load, endpoint):
+        """
+        The cached (version, payload) of the organisation, or the result of
+        `load()` stored on a miss. `load` returns None for a missing
+        organisation, which is not cached.
+        """
+        key = self._key(org_id)
+        entry = self.backend.get(key)
+        self._record(endpoint, 'organisation', entry is not None)
+        if entry is None:
+            with db_router.use_primary():
+                entry = load()
+            if entry is not None:
+                self.backend.set(key, entry, self.ttl)
+        return entry
+
+    def is_member(self, org_id, user_id, load, endpoint):
+        """
+        Whether `user_id` is a member of the organisation, cached, or the
+        result of `load()` stored on a miss.
+        """
+        key = self._member_key(org_id, user_id)
+        is_member = self.backend.get(key)
+        self._record(endpoint, 'membership', is_member is not None)
+        if is_member is None:
+            with db_router.use_primary():
+                is_member = bool(load())
+            self.backend.set(key, is_member, self.ttl)
+        return is_member
+
+    async def aorganisation(self, org_id, load, endpoint):
+        key = self._key(org_id)
+        entry = await self.backend.aget(key)
+        self._record(endpoint, 'organisation', entry is not None)
+        if entry is None:
+            with db_router.use_primary():
+                entry = await load()
+            if entry is not None:
+                await self.backend.aset(key, entry, self.ttl)
+        return entry
+
+    async def ais_member(self, org_id, user_id, load, endpoint):
+        key = self._member_key(org_id, user_id)
+        is_member = await self.backend.aget(key)
+        self._record(endpoint, 'membership', is_member is not None)
+        if is_member is None:
+            with db_router.use_primary():
+                is_member = bool(await load())
+            await self.backend.aset(key, is_member, self.ttl)
+        return is_member
+
+    def invalidate(self, org_ids=(), memberships=()):
+        """
+        Drop the payloads of `org_ids` and the membership flags of the
+        (org_id, user_id) pairs in `memberships` now, and again once the
+        current transaction commits, so that a reader racing the write cannot
+        put the old entry back for the rest of the TTL.
+        """
+        keys = [self._key(org_id) for org_id in org_ids]
+        keys += [self._member_key(org_id, user_id) for org_id, user_id in memberships]
+        if not keys:
+            return
+        self.backend.delete_many(keys)
+        transaction.on_commit(lambda: self.backend.delete_many(keys))
+
+    def hit_ratios(self):
+        """
+        {endpoint: {cache: hit ratio}} over the life of this process.
+        """
+        samples = metrics.registry.collect()
+        counts = {}
+        for (name, labels, _), value in samples.items():
+            if name in ('organisation_cache_hits_total', 'organisation_cache_misses_total'):
+                labels = dict(labels)
+                hits_misses = counts.setdefault(labels['endpoint'], {}).setdefault(labels['cache'], [0, 0])
+                hits_misses[name == 'organisation_cache_misses_total'] += value
+        return {endpoint: {cache: round(hits / (hits + misses), 4) for cache, (hits, misses) in by_cache.items()}
+                for endpoint, by_cache in counts.items()}
+
+
+organisation_cache = OrganisationCache.from_settings()
@@ -0,0 +1,26 @@
+"""
+JSON parser backed by orjson, the counterpart of core.renderers.FastJSONRenderer.
+Falls back to DRF's JSONParser when orjson is unavailable or disabled, or
+when the request body is not UTF-8.
+"""
+
+from django.conf import settings
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+
+from .renderers import FastJSONRenderer, orjson, use_orjson
+
+
+class FastJSONParser(parsers.JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if not use_orjson() or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,66 @@
+"""
+Stores cProfile profiles of sampled production requests, for
+core.middleware.ProfilingMiddleware and the aggregate_profiles command.
+
+A request is profiled when it is picked by the 1-in-PROFILING['SAMPLE_RATE']
+sampler, or when it carries a debug header signed with the SECRET_KEY (see
+`sign_debug_header`, or `manage.py sign_profile_header`). Every profile is
+written to PROFILING['DIR'] as
+
+    <endpoint>.<latency ms>ms.<unix time>.<pid>.prof
+
+so the endpoint and the latency can be read back without loading it.
+"""
+
+import os
+import re
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+
+
+SALT = 'core.profiling'
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_-]+')
+_NAME = re.compile(r'^(?P<endpoint>.+)\.(?P<latency>\d+)ms\.(?P<time>\d+)\.(?P<pid>\d+)\.prof$')
+
+
+def sign_debug_header():
+    """
+    A value for the PROFILING['HEADER'] header that is accepted for
+    PROFILING['HEADER_MAX_AGE'] seconds.
+    """
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def valid_debug_header(value):
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(value, max_age=settings.PROFILING['HEADER_MAX_AGE'])
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def save(profile, endpoint, latency):
+    directory = Path(settings.PROFILING['DIR'])
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{_UNSAFE.sub('_', endpoint)}.{int(latency * 1000)}ms.{int(time.time())}.{os.getpid()}.prof"
+    profile.dump_stats(directory / name)
+    return directory / name
+
+
+def stored(directory=None):
+    """
+    (endpoint, latency in ms, path) for every profile in `directory`.
+    """
+    directory = Path(directory or settings.PROFILING['DIR'])
+    if not directory.is_dir():
+        return []
+    profiles = []
+    for path in sorted(directory.glob('*.prof')):
+        match = _NAME.match(path.name)
+        if match:
+            profiles.append((match['endpoint'], int(match['latency']), path))
+    return profiles
@@ -0,0 +1,69 @@
+"""
+JSON renderer backed by orjson.
+
+orjson serialises UUIDs, datetimes and dict/list/str subclasses (ReturnDict,
+ErrorDetail, ...) natively and several times faster than the standard library
+encoder, so views can hand it UUIDs as they come out of the ORM instead of
+calling str() on them. When orjson is not installed, or JSON_BACKEND is set to
+'stdlib', the renderer behaves exactly like DRF's JSONRenderer.
+"""
+
+from django.conf import settings
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+from . import timing
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def use_orjson():
+    return orjson is not None and getattr(settings, 'JSON_BACKEND', 'orjson') == 'orjson'
+
+
+# Anything orjson cannot serialise itself (Decimal, lazy translations,
+# querysets, ...) is converted the same way DRF's encoder would.
+_default = encoders.JSONEncoder().default
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timing.measure('serialize'):
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type, renderer_context):
+        if not use_orjson():
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if data is None:
+            return b''
+
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        ret = orjson.dumps(data, default=_default, option=option)
+
+        # Escape \u2028 and \u2029 like DRF does, so the output stays a strict
+        # javascript subset.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+def render_ndjson(items, batch_size=500):
+    """
+    Yield `items` as newline-delimited JSON, a batch of lines at a time, for
+    a StreamingHttpResponse.
+    """
+    renderer = FastJSONRenderer()
+    lines = []
+    for item in items:
+        lines.append(renderer.render(item))
+        if len(lines) >= batch_size:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
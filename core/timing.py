@@ -0,0 +1,129 @@
+"""
+Per-request timing breakdown, collected by core.middleware.RequestTimingMiddleware.
+
+The timings of the request being handled live in a context variable, so they
+follow the request across sync_to_async/async_to_sync hops. Code that wants
+its time attributed to a phase wraps it in `measure('<phase>')` or reports it
+with `add('<phase>', seconds)`; both are no-ops outside a timed request.
+
+Every query made on a timed request goes through `record_query`, installed
+as an execute wrapper on each database connection, which counts it, times it
+and tallies its shape for the N+1 detector.
+"""
+
+import contextlib
+import contextvars
+import re
+import time
+from collections import Counter
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+# Collapses "IN (%s, %s, %s)" and multi-row VALUES lists, so that the same
+# query with a different number of parameters has one shape.
+_PARAM_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = Counter()
+        self.queries = 0
+        self.shapes = Counter()
+
+    def add(self, phase, seconds):
+        self.durations[phase] += seconds
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.durations['db'] += seconds
+        self.shapes[_PARAM_LIST.sub('(...)', sql)] += 1
+
+    def repeated_queries(self, threshold):
+        """
+        Query shapes run at least `threshold` times, most repeated first.
+        """
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Start collecting timings for the code run inside the block, which is
+    handed the RequestTimings.
+    """
+    # Connections opened before this module was imported never went through
+    # connection_created.
+    install_on_open_connections()
+    timings = RequestTimings()
+    with resume(timings):
+        yield timings
+
+
+@contextlib.contextmanager
+def resume(timings):
+    """
+    Collect into the RequestTimings of a request again, for the content of a
+    streaming response, which is produced after `collect()` has exited.
+    """
+    reset = _current.set(timings)
+    try:
+        yield
+    finally:
+        _current.reset(reset)
+
+
+def add(phase, seconds):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+@contextlib.contextmanager
+def measure(phase):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, time.perf_counter() - started)
+
+
+def install(connection, **kwargs):
+    # Kept first in the list: connection.execute_wrapper() blocks pop the
+    # last wrapper when they exit.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def install_on_open_connections():
+    for connection in connections.all(initialized_only=True):
+        install(connection)
+
+
+connection_created.connect(install)
@@ -0,0 +1,87 @@
+"""
+In-process cache of authenticated users, keyed by userId.
+
+Entries are evicted least-recently-used once the cache is full and expire
+after a fixed TTL. Writes to a user row invalidate its entry through the
+signal receivers in `user.signals`.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class UserCache:
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'AUTH_USER_CACHE', {})
+        return cls(max_size=config.get('MAX_SIZE', 1024), ttl=config.get('TTL', 60))
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, user_id):
+        """
+        Return a copy of the cached user, or None on a miss. A copy is handed
+        out so that per-request state set on the instance never leaks into
+        other requests.
+        """
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            user = entry[1]
+        return copy.copy(user)
+
+    def set(self, user_id, user):
+        if not self.enabled:
+            return
+        key = str(user_id)
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires_at, copy.copy(user))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+user_cache = UserCache.from_settings()
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 
@@ -23,6 +24,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 AUTH_USER_MODEL = 'user.User'
 
+# Looks users up by email ignoring case and loads only the columns login needs.
+AUTHENTICATION_BACKENDS = ['core.auth_backends.EmailBackend']
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
@@ -49,6 +53,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.RequestTimingMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,7 +92,12 @@ REST_FRAMEWORK = {
                 'core.custom_authentication.CustomUserJWTAuthentication',
         ],
 
-        'DEFAULT_PARSER_CLASSES': ['rest_framework.parsers.JSONParser'],
+        'DEFAULT_RENDERER_CLASSES': [
+                'core.renderers.FastJSONRenderer',
+                'rest_framework.renderers.BrowsableAPIRenderer',
+        ],
+
+        'DEFAULT_PARSER_CLASSES': ['core.parsers.FastJSONParser'],
 
         # 'DEFAULT_PERMISSION_CLASSES': [
         #     'rest_framework.permissions.IsAuthenticated',
@@ -92,6 +105,149 @@ REST_FRAMEWORK = {
         # ]
 }
 
+# JSON encoder/decoder used by the API: 'orjson' (when installed) or 'stdlib'.
+# JSON_BACKEND=stdlib turns orjson off even where it is installed.
+JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson")
+
+# In-process cache of the user loaded by CustomUserJWTAuthentication.
+# Set AUTH_USER_CACHE_MAX_SIZE=0 to disable it.
+#
+# Invalidation is process-local: saving or deleting a user only drops them
+# from the cache of the worker that made the change. Every other worker keeps
+# authenticating the cached row, a deactivated or deleted user included, for
+# up to AUTH_USER_CACHE_TTL seconds, where is_active used to be checked
+# against the database on every request. Lower the TTL, or disable the cache,
+# where that window matters.
+AUTH_USER_CACHE = {
+    'MAX_SIZE': int(os.getenv("AUTH_USER_CACHE_MAX_SIZE", 1024)),
+    'TTL': int(os.getenv("AUTH_USER_CACHE_TTL", 60)),
+}
+
+# Put the user's profile fields and version in the token so that requests can
+# be authenticated without loading the user row.
+#
+# Claims can go stale: a token keeps the profile, and is_active, it was issued
+# with for its whole lifetime (User.TOKEN_LIFETIME). Every save of a user
+# records their new version in the 'token-versions' cache for that long, and
+# a token carrying an older version is authenticated from the user row
+# instead. The cache is process-local by default, so a worker that did not
+# handle the write keeps accepting the old claims, a deactivated user
+# included, until the token expires; set AUTH_TOKEN_VERSION_CACHE_BACKEND and
+# AUTH_TOKEN_VERSION_CACHE_LOCATION to a shared cache to close that window.
+AUTH_TOKEN_CLAIMS = os.getenv("AUTH_TOKEN_CLAIMS", "False").lower() in ('1', 'true', 'yes')
+
+# Largest list of userIds accepted by POST /api/organisations/<orgId>/users.
+ORGANISATION_BULK_ADD_LIMIT = int(os.getenv("ORGANISATION_BULK_ADD_LIMIT", 5000))
+
+# Largest list of userIds accepted by POST /api/users/batch.
+USER_BATCH_LIMIT = int(os.getenv("USER_BATCH_LIMIT", 500))
+
+# Bulk registration: largest request accepted by POST /auth/register/bulk, rows
+# written per transaction and the password-hashing processes of
+# `manage.py import_users` (the endpoint hashes on PASSWORD_HASHING's executor).
+BULK_REGISTER_LIMIT = int(os.getenv("BULK_REGISTER_LIMIT", 1000))
+BULK_REGISTER_CHUNK_SIZE = int(os.getenv("BULK_REGISTER_CHUNK_SIZE", 1000))
+BULK_REGISTER_WORKERS = int(os.getenv("BULK_REGISTER_WORKERS", os.cpu_count() or 1))
+
+# Pool that password hashing runs on (see core/hashing.py). EXECUTOR is one of
+# inline, thread or process.
+PASSWORD_HASHING = {
+    'EXECUTOR': os.getenv("PASSWORD_HASH_EXECUTOR", "thread"),
+    'WORKERS': int(os.getenv("PASSWORD_HASH_WORKERS", 4)),
+    'MAX_QUEUE': int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64)),
+    'QUEUE_TIMEOUT': float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", 2)),
+}
+
+# Serialized single-organisation payloads and per-user membership flags
+# (core.organisation_cache) are kept in the ORGANISATION_CACHE['ALIAS'] cache.
+# It is process-local by default; set ORGANISATION_CACHE_BACKEND and
+# ORGANISATION_CACHE_LOCATION (e.g. django.core.cache.backends.redis.RedisCache
+# and redis://127.0.0.1:6379) to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'organisations': {
+        'BACKEND': os.getenv("ORGANISATION_CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("ORGANISATION_CACHE_LOCATION", 'organisations'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv("ORGANISATION_CACHE_MAX_ENTRIES", 10000))},
+    },
+    # Latest version of the users whose row changed (see AUTH_TOKEN_CLAIMS).
+    'token-versions': {
+        'BACKEND': os.getenv("AUTH_TOKEN_VERSION_CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("AUTH_TOKEN_VERSION_CACHE_LOCATION", 'token-versions'),
+    },
+    # Users who just wrote, read from the primary (see REPLICAS below).
+    'replica-sticky': {
+        'BACKEND': os.getenv("REPLICA_STICKY_CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("REPLICA_STICKY_CACHE_LOCATION", 'replica-sticky'),
+    },
+}
+
+ORGANISATION_CACHE = {
+    'ALIAS': 'organisations',
+    'TTL': int(os.getenv("ORGANISATION_CACHE_TTL", 300)),
+}
+
+# Per-request query count and timing breakdown (core.middleware.RequestTimingMiddleware),
+# sent as a Server-Timing header and logged as JSON on the 'core.timing' logger.
+REQUEST_TIMING = {
+    'ENABLED': os.getenv("REQUEST_TIMING", "True").lower() in ('1', 'true', 'yes'),
+    'SERVER_TIMING_HEADER': os.getenv("REQUEST_TIMING_HEADER", "True").lower() in ('1', 'true', 'yes'),
+    'LOG': os.getenv("REQUEST_TIMING_LOG", "True").lower() in ('1', 'true', 'yes'),
+    # Identical query shapes repeated this many times in one request are logged as N+1.
+    'N_PLUS_ONE_THRESHOLD': int(os.getenv("REQUEST_TIMING_N_PLUS_ONE_THRESHOLD", 5)),
+}
+
+# Prometheus metrics at /metrics (core.metrics). Set METRICS_TOKEN to require
+# "Authorization: Bearer <token>" on scrapes. Under a multi-worker server, point
+# METRICS_MULTIPROCESS_DIR at a directory shared by the workers so that every
+# scrape reports all of them; empty it when the server (re)starts.
+METRICS = {
+    'ENABLED': os.getenv("METRICS", "True").lower() in ('1', 'true', 'yes'),
+    'TOKEN': os.getenv("METRICS_TOKEN", ""),
+    'MULTIPROCESS_DIR': os.getenv("METRICS_MULTIPROCESS_DIR", ""),
+    'FLUSH_INTERVAL': float(os.getenv("METRICS_FLUSH_INTERVAL", 5)),
+}
+
+# cProfile 1 in SAMPLE_RATE requests (0 to only profile requests carrying a
+# signed HEADER, see `manage.py sign_profile_header`) into DIR. Aggregate the
+# profiles with `manage.py aggregate_profiles`.
+PROFILING = {
+    'ENABLED': os.getenv("PROFILING", "False").lower() in ('1', 'true', 'yes'),
+    'SAMPLE_RATE': int(os.getenv("PROFILING_SAMPLE_RATE", 1000)),
+    'DIR': os.getenv("PROFILING_DIR", str(BASE_DIR / 'profiles')),
+    'HEADER': os.getenv("PROFILING_HEADER", "X-Debug-Profile"),
+    'HEADER_MAX_AGE': int(os.getenv("PROFILING_HEADER_MAX_AGE", 3600)),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.timing': {
+            'handlers': ['console'],
+            'level': os.getenv("REQUEST_TIMING_LOG_LEVEL", "INFO"),
+            'propagate': False,
+        },
+    },
+}
+
+# Keyset-paginated listings (e.g. GET /api/organisations).
+PAGINATION_PAGE_SIZE = int(os.getenv("PAGINATION_PAGE_SIZE", 100))
+PAGINATION_MAX_PAGE_SIZE = int(os.getenv("PAGINATION_MAX_PAGE_SIZE", 1000))
+
+# Rows fetched per round trip when streaming a listing as NDJSON.
+STREAMING_CHUNK_SIZE = int(os.getenv("STREAMING_CHUNK_SIZE", 2000))
+
+# How far the watermark of an incremental export (user/export.py) is set back
+# to cover rows whose transaction had not committed when the export read
+# them. Must exceed the longest write transaction.
+EXPORT_WATERMARK_MARGIN = int(os.getenv("EXPORT_WATERMARK_MARGIN", 300))
+
 WSGI_APPLICATION = 'hng_stage2.wsgi.application'
 
 
@@ -108,6 +264,67 @@ DATABASES = {
     }
 }
 
+# How connections to the database are managed:
+#   per-request  open and close a connection for every request (Django's default)
+#   persistent   keep each thread's connection for DB_CONN_MAX_AGE seconds,
+#                health-checked before it is reused
+#   pool         share a pool of DB_POOL_SIZE connections per process
+#                (see core/db_pool/__init__.py)
+#   serverless   for short-lived invocations (Vercel) behind a transaction-mode
+#                pooler such as PgBouncer: short-lived, health-checked
+#                connections and no server-side cursors
+DB_CONNECTION_MODE = os.getenv("DB_CONNECTION_MODE", "per-request")
+
+if DB_CONNECTION_MODE == 'persistent':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 600)),
+        'CONN_HEALTH_CHECKS': True,
+    })
+elif DB_CONNECTION_MODE == 'pool':
+    DATABASES['default'].update({
+        'ENGINE': 'core.db_pool',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'SIZE': int(os.getenv("DB_POOL_SIZE", 10)),
+            'MAX_LIFETIME': int(os.getenv("DB_POOL_MAX_LIFETIME", 1800)),
+            'HEALTH_CHECK': os.getenv("DB_POOL_HEALTH_CHECK", "True").lower() in ('1', 'true', 'yes'),
+            'TIMEOUT': float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        },
+    })
+elif DB_CONNECTION_MODE == 'serverless':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", 30)),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': True,
+        'OPTIONS': {
+            'connect_timeout': int(os.getenv("DB_CONNECT_TIMEOUT", 5)),
+            'keepalives': 1,
+            'keepalives_idle': 30,
+        },
+    })
+elif DB_CONNECTION_MODE != 'per-request':
+    raise ImproperlyConfigured(f"Unknown DB_CONNECTION_MODE {DB_CONNECTION_MODE!r}")
+
+# Read replicas, as a comma-separated list of hosts reached with the primary's
+# credentials and connection mode. With any set, the reads of GET/HEAD/OPTIONS
+# requests go to them, except for users who wrote within the last
+# REPLICAS['STICKY_SECONDS'] (see core/db_router.py). The sticky users are kept
+# in the REPLICAS['CACHE'] cache, which must be shared between processes for
+# the stickiness to hold across workers: set REPLICA_STICKY_CACHE_BACKEND and
+# REPLICA_STICKY_CACHE_LOCATION (Redis, Memcached, ...) along with the hosts.
+# ReplicaRoutingMiddleware refuses to start on a local-memory cache.
+DATABASE_REPLICA_HOSTS = [host.strip() for host in os.getenv("DATABASE_REPLICA_HOSTS", "").split(",") if host.strip()]
+for index, host in enumerate(DATABASE_REPLICA_HOSTS, 1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+
+REPLICAS = {
+    'ALIASES': [f'replica{index}' for index in range(1, len(DATABASE_REPLICA_HOSTS) + 1)],
+    'STICKY_SECONDS': int(os.getenv("REPLICA_STICKY_SECONDS", 5)),
+    'CACHE': os.getenv("REPLICA_STICKY_CACHE", 'replica-sticky'),
+}
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
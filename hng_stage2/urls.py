@@ -17,7 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from core.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
+    path('async/', include('user.async_urls')),
     path('', include('user.urls'))
 ]
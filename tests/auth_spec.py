@@ -1,12 +1,41 @@
+import csv
+import gzip
+import io
+import json
 import jwt
-from django.test import TestCase
+import os
+import subprocess
+import tempfile
+import threading
+import uuid
+from unittest import mock
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from rest_framework.exceptions import ParseError
 from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
 
+from core import hashing, metrics, middleware, profiling, timing
+from core.ids import uuid7
+from core.custom_authentication import CustomUserJWTAuthentication
+from core.db_pool import ConnectionPool
+from core.exceptions import NoTokenError
+from core.organisation_cache import organisation_cache
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+from core.user_cache import user_cache
 from hng_stage2 import settings
+from user import bulk
+from user.bulk import register_users
+from user.export import watermark
 from user.models import Organisation
 from user.views import *
 
@@ -231,4 +260,1227 @@ class EndToEndTestCase(TestCase):
         self.assertTrue(org.users.filter(email='john@example.com').exists())
 
 
+class RegistrationWritePathTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.data = {
+            'firstName': 'John',
+            'lastName': 'Doe',
+            'email': 'john@example.com',
+            'password': 'securepassword123',
+            'phone': '07055534343'
+        }
+
+    def _statements(self, queries):
+        # Savepoints are only there because TestCase wraps every test in a transaction.
+        return [q['sql'] for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+
+    def test_registration_takes_at_most_two_statements(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('register_user'), self.data, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        statements = self._statements(queries)
+        self.assertLessEqual(len(statements), 1 if connection.vendor == 'postgresql' else 3)
+        self.assertFalse([sql for sql in statements if sql.startswith('SELECT')])
+        user = User.objects.get(email='john@example.com')
+        self.assertEqual(list(user.organisations.values_list('name', flat=True)), ["John's Organisation"])
+
+    def test_duplicate_email_is_rejected_by_the_unique_index(self):
+        self.client.post(reverse('register_user'), self.data, format='json')
+        response = self.client.post(reverse('register_user'), dict(self.data, firstName='Jane'), format='json')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['errors'], [{'field': 'email', 'message': DUPLICATE_EMAIL_MESSAGE}])
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(Organisation.objects.count(), 1)
+
+
+class UserCacheTestCase(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            email='cached@example.com',
+            password='password123',
+            firstName='Cached',
+            lastName='User'
+        )
+        self.auth = CustomUserJWTAuthentication()
+
+    def test_repeated_authentication_is_served_from_cache(self):
+        token = self.user.token
+        with self.assertNumQueries(1):
+            self.auth._authenticate_credentials(None, token)
+        with self.assertNumQueries(0):
+            user, _ = self.auth._authenticate_credentials(None, token)
+
+        self.assertEqual(user.userId, self.user.userId)
+        self.assertEqual(user_cache.stats()['hits'], 1)
+        self.assertEqual(user_cache.stats()['misses'], 1)
+
+    def test_saving_user_invalidates_cache(self):
+        token = self.user.token
+        self.auth._authenticate_credentials(None, token)
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(NoTokenError):
+            self.auth._authenticate_credentials(None, token)
+
+
+@override_settings(AUTH_TOKEN_CLAIMS=True)
+class ClaimsTokenTestCase(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        caches['token-versions'].clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email='claims@example.com',
+            password='password123',
+            firstName='Claims',
+            lastName='User',
+            phone='0800000000'
+        )
+
+    def test_token_carries_profile_claims(self):
+        decoded_token = jwt.decode(self.user.token, settings.SECRET_KEY, algorithms=['HS256'])
+
+        self.assertEqual(decoded_token['email'], 'claims@example.com')
+        self.assertEqual(decoded_token['firstName'], 'Claims')
+        self.assertTrue(decoded_token['is_active'])
+        self.assertEqual(decoded_token['ver'], self.user.version)
+
+    def test_own_user_detail_needs_no_query(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.user.token}')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('get_user_detail', args=[str(self.user.userId)]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['email'], 'claims@example.com')
+        self.assertEqual(response.data['data']['phone'], '0800000000')
+
+    def test_claims_older_than_the_last_change_are_not_trusted(self):
+        token = self.user.token
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(NoTokenError):
+            CustomUserJWTAuthentication()._authenticate_credentials(None, token)
+
+    def test_fields_outside_the_claims_are_loaded_lazily(self):
+        user, _ = CustomUserJWTAuthentication()._authenticate_credentials(None, self.user.token)
+
+        self.assertIsInstance(user, User)
+        with self.assertNumQueries(1):
+            self.assertFalse(user.is_staff)
+
+
+class UserDetailTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(
+            email='detail1@example.com',
+            password='password123',
+            firstName='Detail',
+            lastName='One'
+        )
+        self.user2 = User.objects.create_user(
+            email='detail2@example.com',
+            password='password123',
+            firstName='Detail',
+            lastName='Two'
+        )
+        self.user3 = User.objects.create_user(
+            email='detail3@example.com',
+            password='password123',
+            firstName='Detail',
+            lastName='Three'
+        )
+        self.org = Organisation.objects.create(name="Shared Org")
+        self.org.users.add(self.user1, self.user2)
+        self.client.force_authenticate(user=self.user1)
+
+    def test_user_in_shared_organisation_is_fetched_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('get_user_detail', args=[str(self.user2.userId)]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['userId'], str(self.user2.userId))
+        self.assertEqual(response.json()['data']['lastName'], 'Two')
+
+    def test_user_outside_shared_organisations_is_forbidden(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('get_user_detail', args=[str(self.user3.userId)]))
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_user_is_not_found(self):
+        response = self.client.get(reverse('get_user_detail', args=['not-a-uuid']))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_batch_lookup_marks_each_user_in_one_query(self):
+        missing = uuid.uuid4()
+        user_ids = [self.user2.userId, self.user3.userId, missing, self.user1.userId]
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('get_user_details'),
+                                        {'userIds': [str(user_id) for user_id in user_ids]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        users = response.json()['data']['users']
+        self.assertEqual([user['userId'] for user in users], [str(user_id) for user_id in user_ids])
+        self.assertEqual(users[0]['lastName'], 'Two')
+        self.assertEqual(users[1]['error'], 'forbidden')
+        self.assertEqual(users[2]['error'], 'not_found')
+        self.assertEqual(users[3]['email'], 'detail1@example.com')
+
+    def test_batch_lookup_rejects_invalid_ids(self):
+        response = self.client.post(reverse('get_user_details'), {'userIds': ['not-a-uuid']}, format='json')
+
+        self.assertEqual(response.status_code, 422)
+
+
+class BulkAddUsersTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(
+            email='owner@example.com',
+            password='password123',
+            firstName='Org',
+            lastName='Owner'
+        )
+        self.members = [
+            User.objects.create_user(
+                email=f'member{i}@example.com',
+                password='password123',
+                firstName='Member',
+                lastName=str(i)
+            )
+            for i in range(3)
+        ]
+        self.org = Organisation.objects.create(name="Bulk Org")
+        self.org.users.add(self.owner)
+        self.client.force_authenticate(user=self.owner)
+        self.url = reverse('add-user-to-org', args=[str(self.org.orgId)])
+
+    def test_bulk_add_reports_a_result_per_user(self):
+        missing = uuid.uuid4()
+        user_ids = [str(self.owner.userId)] + [str(member.userId) for member in self.members] + [str(missing)]
+
+        response = self.client.post(self.url, {'userIds': user_ids}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = {row['userId']: row['result'] for row in response.json()['data']['results']}
+        self.assertEqual(results[str(self.owner.userId)], 'already-member')
+        self.assertEqual(results[str(missing)], 'not-found')
+        for member in self.members:
+            self.assertEqual(results[str(member.userId)], 'added')
+        self.assertEqual(self.org.users.count(), 4)
+
+    def test_bulk_add_cost_does_not_grow_with_the_number_of_users(self):
+        # Caches the owner's membership flag, looked up on the first call only.
+        self.client.post(self.url, {'userIds': [str(self.owner.userId)]}, format='json')
+        with CaptureQueriesContext(connection) as one_user:
+            self.client.post(self.url, {'userIds': [str(self.members[0].userId)]}, format='json')
+        with CaptureQueriesContext(connection) as two_users:
+            self.client.post(self.url, {'userIds': [str(member.userId) for member in self.members[1:]]},
+                             format='json')
+
+        self.assertEqual(len(one_user), len(two_users))
+
+    def test_bulk_add_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.post(self.url, {'userIds': [str(self.members[0].userId)]}, format='json')
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.org.users.count(), 1)
+
+    def test_bulk_add_is_reserved_to_members(self):
+        self.client.force_authenticate(user=self.members[0])
+        response = self.client.post(self.url, {'userIds': [str(self.members[1].userId)]}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.org.users.count(), 1)
+
+    def test_single_user_add_is_unchanged(self):
+        response = self.client.post(self.url, {'userId': str(self.members[0].userId)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'User added to organisation successfully')
+
+
+class BulkRegistrationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.existing = User.objects.create_user(
+            email='existing@example.com',
+            password='password123',
+            firstName='Existing',
+            lastName='User'
+        )
+        self.rows = [
+            {'firstName': 'Ada', 'lastName': 'One', 'email': 'ada@example.com',
+             'phone': '0800000001', 'password': 'securepassword1'},
+            {'firstName': 'Ada', 'lastName': 'Again', 'email': 'ada@example.com',
+             'phone': '0800000002', 'password': 'securepassword2'},
+            {'firstName': 'Existing', 'lastName': 'User', 'email': 'existing@example.com',
+             'phone': '0800000003', 'password': 'securepassword3'},
+            {'firstName': 'No', 'lastName': 'Email', 'phone': '0800000004', 'password': 'securepassword4'},
+        ]
+
+    def test_register_users_reports_a_result_per_row(self):
+        results = list(register_users(self.rows, chunk_size=2))
+
+        self.assertEqual([r['result'] for r in results], ['created', 'duplicate', 'duplicate', 'invalid'])
+        self.assertEqual(results[3]['errors'][0]['field'], 'email')
+
+        user = User.objects.get(email='ada@example.com')
+        self.assertTrue(user.check_password('securepassword1'))
+        org = Organisation.objects.get(name="Ada's Organisation")
+        self.assertTrue(org.users.filter(pk=user.pk).exists())
+
+    def test_email_registered_during_the_import_is_reported_as_a_duplicate(self):
+        real_registered = bulk._registered
+        lookups = []
+
+        def registered(emails):
+            # The first lookup runs before `existing` is registered concurrently.
+            lookups.append(emails)
+            return set() if len(lookups) == 1 else real_registered(emails)
+
+        with mock.patch('user.bulk._registered', side_effect=registered):
+            results = list(register_users([self.rows[2], self.rows[0]]))
+
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual([r['result'] for r in results], ['duplicate', 'created'])
+        self.assertTrue(User.objects.filter(email='ada@example.com').exists())
+
+    def test_import_users_command_reads_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            writer = csv.DictWriter(f, fieldnames=['firstName', 'lastName', 'email', 'phone', 'password'])
+            writer.writeheader()
+            writer.writerows(self.rows[:1])
+
+        call_command('import_users', f.name, workers=1, stdout=io.StringIO())
+        os.unlink(f.name)
+
+        self.assertTrue(User.objects.filter(email='ada@example.com').exists())
+
+    def test_bulk_endpoint_requires_staff(self):
+        self.client.force_authenticate(user=self.existing)
+
+        response = self.client.post(reverse('register_users_in_bulk'), {'users': self.rows}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class PasswordHashingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email='hashing@example.com',
+            password='password123',
+            firstName='Hashing',
+            lastName='User'
+        )
+        self.credentials = {'email': 'hashing@example.com', 'password': 'password123'}
+
+    def test_login_hashes_on_the_executor(self):
+        executor = hashing.HashingExecutor(kind='thread', workers=1)
+        with mock.patch.object(hashing, 'executor', executor):
+            response = self.client.post(reverse('login_user'), self.credentials, format='json')
+        executor.shutdown()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(executor.stats()['calls'], 1)
+
+    def test_login_is_rejected_when_the_hashing_queue_is_full(self):
+        executor = hashing.HashingExecutor(kind='thread', workers=1, max_queue=0, queue_timeout=0)
+        executor._slots.acquire()
+        with mock.patch.object(hashing, 'executor', executor):
+            response = self.client.post(reverse('login_user'), self.credentials, format='json')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(executor.stats()['rejected'], 1)
+
+    def test_bulk_registration_shares_the_executor_and_its_queue(self):
+        self.client.force_authenticate(user=User.objects.create_user(
+            email='hashing-admin@example.com', password='password123', firstName='Hashing', lastName='Admin',
+            is_staff=True
+        ))
+        rows = [{'firstName': 'Bulk', 'lastName': str(i), 'email': f'bulk-hash{i}@example.com',
+                 'phone': '0800000000', 'password': 'password123'} for i in range(6)]
+        executor = hashing.HashingExecutor(kind='thread', workers=1, max_queue=1)
+        with mock.patch.object(hashing, 'executor', executor):
+            response = self.client.post(reverse('register_users_in_bulk'), {'users': rows[:3]}, format='json')
+            # Every slot taken by other requests.
+            for _ in range(2):
+                executor._slots.acquire()
+            executor.queue_timeout = 0
+            busy = self.client.post(reverse('register_users_in_bulk'), {'users': rows[3:]}, format='json')
+        executor.shutdown()
+
+        self.assertEqual([r['result'] for r in response.json()['data']['results']], ['created'] * 3)
+        self.assertEqual(executor.stats()['calls'], 3)
+        self.assertEqual(busy.status_code, 503)
+
+
+class OrganisationPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email='pages@example.com',
+            password='password123',
+            firstName='Page',
+            lastName='User'
+        )
+        for i in range(5):
+            Organisation.objects.create(name=f"Org {i}").users.add(self.user)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('user-organisations')
+
+    def test_pages_cover_every_organisation_once(self):
+        body = self.client.get(self.url, {'limit': 2}).json()
+        seen = [org['orgId'] for org in body['data']['organisations']]
+        while body['data']['nextCursor']:
+            body = self.client.get(self.url, {'limit': 2, 'cursor': body['data']['nextCursor']}).json()
+            seen += [org['orgId'] for org in body['data']['organisations']]
+
+        expected = sorted(str(org.orgId) for org in self.user.organisations.all())
+        self.assertEqual(seen, expected)
+
+    def test_first_page_keeps_the_organisations_shape(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['data']['organisations']), 5)
+        self.assertIsNone(response.data['data']['nextCursor'])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'cursor': '!!'})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['errors'][0]['field'], 'cursor')
+
+    def test_values_serializer_matches_model_serializer(self):
+        organisations = self.user.organisations.order_by('orgId')
+        rows = OrganisationValuesSerializer.rows(organisations)
+
+        self.assertEqual(json.loads(json.dumps(OrganisationValuesSerializer.many(rows), default=str)),
+                         json.loads(json.dumps(OrganisationSerializer(organisations, many=True).data)))
+
+
+class AsyncEndpointsTestCase(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            email='async@example.com',
+            password='password123',
+            firstName='Async',
+            lastName='User'
+        )
+        self.org = Organisation.objects.create(name="Async Org")
+        self.org.users.add(self.user)
+        self.headers = {'Authorization': f'Bearer {self.user.token}'}
+
+    async def test_login(self):
+        response = await self.async_client.post(reverse('async-login-user'),
+                                                {'email': 'async@example.com', 'password': 'password123'},
+                                                content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['user']['email'], 'async@example.com')
+
+    async def test_login_with_wrong_password(self):
+        response = await self.async_client.post(reverse('async-login-user'),
+                                                {'email': 'async@example.com', 'password': 'wrong-password'},
+                                                content_type='application/json')
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_register(self):
+        response = await self.async_client.post(reverse('async-register-user'), {
+            'firstName': 'Jane',
+            'lastName': 'Doe',
+            'email': 'jane@example.com',
+            'password': 'securepassword123',
+            'phone': '07055534343'
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await Organisation.objects.filter(name="Jane's Organisation").aexists())
+
+    async def test_organisations(self):
+        response = await self.async_client.get(reverse('async-user-organisations'), headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['organisations'][0]['orgId'], str(self.org.orgId))
+
+        response = await self.async_client.get(reverse('async-single-organisation', args=[str(self.org.orgId)]),
+                                               headers=self.headers)
+        self.assertEqual(response.json()['data']['name'], 'Async Org')
+
+    async def test_single_organisation_honours_if_none_match(self):
+        url = reverse('async-single-organisation', args=[str(self.org.orgId)])
+        etag = (await self.async_client.get(url, headers=self.headers))['ETag']
+
+        response = await self.async_client.get(url, headers={**self.headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_user_detail_requires_a_token(self):
+        response = await self.async_client.get(reverse('async-user-detail', args=[str(self.user.userId)]))
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['message'], 'Authentication failed')
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.info = mock.Mock(transaction_status=TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        return mock.MagicMock()
+
+    def rollback(self):
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def test_connections_are_reused(self):
+        pool = ConnectionPool(size=2)
+        connection = pool.checkout(FakeConnection)
+        pool.checkin(connection)
+
+        self.assertIs(pool.checkout(FakeConnection), connection)
+        self.assertEqual(pool.stats()['opened'], 1)
+        self.assertEqual(pool.stats()['reused'], 1)
+
+    def test_open_transaction_is_rolled_back_on_checkin(self):
+        pool = ConnectionPool(size=1)
+        connection = pool.checkout(FakeConnection)
+        connection.info.transaction_status = TRANSACTION_STATUS_INTRANS
+        pool.checkin(connection)
+
+        self.assertIs(pool.checkout(FakeConnection), connection)
+        self.assertEqual(connection.info.transaction_status, TRANSACTION_STATUS_IDLE)
+
+    def test_autocommit_is_restored_on_checkin(self):
+        pool = ConnectionPool(size=1)
+        connection = pool.checkout(FakeConnection)
+        connection.autocommit = False
+        connection.info.transaction_status = TRANSACTION_STATUS_INTRANS
+        pool.checkin(connection)
+
+        self.assertIs(pool.checkout(FakeConnection), connection)
+        self.assertTrue(connection.autocommit)
+
+    def test_expired_and_broken_connections_are_replaced(self):
+        pool = ConnectionPool(size=1, max_lifetime=0)
+        connection = pool.checkout(FakeConnection)
+        pool.checkin(connection)
+
+        self.assertIsNot(pool.checkout(FakeConnection), connection)
+        self.assertTrue(connection.closed)
+
+    def test_checkout_times_out_when_the_pool_is_exhausted(self):
+        pool = ConnectionPool(size=1, timeout=0)
+        pool.checkout(FakeConnection)
+
+        with self.assertRaises(OperationalError):
+            pool.checkout(FakeConnection)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+
+class FastJSONTestCase(SimpleTestCase):
+    payload = {
+        'status': 'success',
+        'data': {
+            'userId': uuid.UUID('6fbf9546-9981-45b9-ab43-08bdf92c42e5'),
+            'name': 'Org \u2028 1',
+            'created': datetime(2024, 7, 8, 16, 9, tzinfo=dt_timezone.utc),
+        }
+    }
+
+    def test_renderer_matches_drf_output(self):
+        fast = FastJSONRenderer().render(self.payload)
+        with override_settings(JSON_BACKEND='stdlib'):
+            stdlib = FastJSONRenderer().render(self.payload)
+
+        self.assertEqual(json.loads(fast), json.loads(stdlib))
+        self.assertIn(b'"6fbf9546-9981-45b9-ab43-08bdf92c42e5"', fast)
+        self.assertIn(b'\\u2028', fast)
+
+    def test_parser_round_trip(self):
+        body = FastJSONRenderer().render({'email': 'john@example.com', 'password': 'x'})
+
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), {'email': 'john@example.com', 'password': 'x'})
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{not json'))
+
+
+class RequestTimingTestCase(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            email='timed@example.com',
+            password='password123',
+            firstName='Timed',
+            lastName='User'
+        )
+        self.org = Organisation.objects.create(name="Timed Org")
+        self.org.users.add(self.user)
+        self.headers = {'Authorization': f'Bearer {self.user.token}'}
+
+    def test_server_timing_header_breaks_down_the_request(self):
+        response = self.client.get(reverse('user-organisations'), headers=self.headers)
+
+        metrics = {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+        self.assertEqual(set(metrics), {'db', 'auth', 'hash', 'serialize', 'total'})
+        # The user row for authentication, the list's ETag state, then the page of organisations.
+        self.assertIn('desc="3 queries"', metrics['db'])
+
+    def test_request_is_logged_as_json(self):
+        with self.assertLogs('core.timing', level='INFO') as logs:
+            self.client.get(reverse('user-organisations'), headers=self.headers)
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'user-organisations')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['queries'], 3)
+
+    def test_streamed_queries_are_logged_once_the_stream_is_sent(self):
+        url = reverse('add-user-to-org', args=[str(self.org.orgId)])
+        with self.assertLogs('core.timing', level='INFO') as logs:
+            response = self.client.get(url, {'stream': 'true'}, headers=self.headers)
+            logged_before_streaming = len(logs.records)
+            b''.join(response.streaming_content)
+
+        self.assertEqual(len(logs.records), logged_before_streaming + 1)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'add-user-to-org')
+        # The members are only read while the stream is sent.
+        self.assertIn(f'desc="{record["queries"] - 1} queries"', response['Server-Timing'])
+
+    def test_repeated_query_shapes_are_flagged(self):
+        with timing.collect() as timings:
+            for user in User.objects.all():
+                list(user.organisations.all())
+            for size in range(1, 5):
+                list(User.objects.filter(pk__in=[uuid.uuid4() for _ in range(size)]))
+
+        self.assertEqual(timings.queries, 6)
+        self.assertEqual([count for _, count in timings.repeated_queries(4)], [4])
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            email='profiled@example.com',
+            password='password123',
+            firstName='Profiled',
+            lastName='User'
+        )
+        self.headers = {'Authorization': f'Bearer {self.user.token}'}
+        self.dir = tempfile.mkdtemp()
+        self.settings = {'ENABLED': True, 'SAMPLE_RATE': 0, 'DIR': self.dir, 'HEADER': 'X-Debug-Profile',
+                         'HEADER_MAX_AGE': 60}
+
+    def test_only_requests_with_a_signed_header_are_profiled_when_sampling_is_off(self):
+        with override_settings(PROFILING=self.settings):
+            self.client.get(reverse('user-organisations'), headers=self.headers)
+            self.client.get(reverse('user-organisations'),
+                            headers={**self.headers, 'X-Debug-Profile': 'forged:header'})
+            self.client.get(reverse('user-organisations'),
+                            headers={**self.headers, 'X-Debug-Profile': profiling.sign_debug_header()})
+
+            self.assertEqual([endpoint for endpoint, _, _ in profiling.stored()], ['user-organisations'])
+
+    def test_requests_are_served_unprofiled_while_another_profile_runs(self):
+        with override_settings(PROFILING=dict(self.settings, SAMPLE_RATE=1)):
+            with middleware._profiling_lock:
+                response = self.client.get(reverse('user-organisations'), headers=self.headers)
+            with mock.patch('cProfile.Profile.enable', side_effect=ValueError):
+                self.client.get(reverse('user-organisations'), headers=self.headers)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(profiling.stored(), [])
+
+    def test_aggregate_lists_hot_functions_per_endpoint(self):
+        with override_settings(PROFILING=dict(self.settings, SAMPLE_RATE=1)):
+            for _ in range(2):
+                self.client.get(reverse('user-organisations'), headers=self.headers)
+            out = io.StringIO()
+            call_command('aggregate_profiles', '--json', '--top', '5', stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['user-organisations']['profiles'], 2)
+        self.assertEqual(len(report['user-organisations']['functions']), 5)
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            email='metered@example.com',
+            password='password123',
+            firstName='Metered',
+            lastName='User'
+        )
+        self.headers = {'Authorization': f'Bearer {self.user.token}'}
+
+    def _scrape(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+                for line in response.content.decode().splitlines() if not line.startswith('#')}
+
+    def test_latency_histogram_and_error_counts_per_url_name(self):
+        before = self._scrape()
+        self.client.get(reverse('user-organisations'), headers=self.headers)
+        self.client.get(reverse('single-organisation', args=[uuid.uuid4()]), headers=self.headers)
+        after = self._scrape()
+
+        count = 'http_request_duration_seconds_count{view="user-organisations"}'
+        inf = 'http_request_duration_seconds_bucket{view="user-organisations",le="+Inf"}'
+        errors = 'http_errors_total{view="single-organisation",status="404"}'
+        self.assertEqual(after[count] - before.get(count, 0), 1)
+        self.assertEqual(after[inf], after[count])
+        self.assertEqual(after[errors] - before.get(errors, 0), 1)
+        self.assertIn('auth_user_cache_misses_total', after)
+
+    def test_threads_record_without_losing_updates(self):
+        registry = metrics.Registry()
+
+        def record():
+            for _ in range(1000):
+                registry.inc('http_errors_total', (('view', 'x'), ('status', '500')))
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(registry.collect()[('http_errors_total', (('view', 'x'), ('status', '500')), None)], 8000)
+        # The shards of the finished threads were folded into the total.
+        self.assertEqual(registry._shards, {})
+
+    def test_multiprocess_mode_sums_every_worker_file(self):
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, '1.json'), 'w') as f:
+            json.dump([['http_errors_total', [['view', 'x'], ['status', '500']], None, 3]], f)
+        registry = metrics.Registry()
+        registry.inc('http_errors_total', (('view', 'x'), ('status', '500')), 2)
+
+        with override_settings(METRICS=dict(settings.METRICS, MULTIPROCESS_DIR=directory)):
+            samples = registry.gather()
+
+        self.assertEqual(samples[('http_errors_total', (('view', 'x'), ('status', '500')), None)], 5)
+        self.assertTrue(os.path.exists(os.path.join(directory, f'{os.getpid()}.json')))
+
+    def test_files_of_exited_workers_are_archived_without_their_gauges(self):
+        directory = tempfile.mkdtemp()
+        worker = subprocess.Popen(['true'])
+        worker.wait()
+        with open(os.path.join(directory, f'{worker.pid}.json'), 'w') as f:
+            json.dump([['http_errors_total', [['view', 'x'], ['status', '500']], None, 3],
+                       ['auth_user_cache_size', [], None, 10]], f)
+        registry = metrics.Registry()
+
+        with override_settings(METRICS=dict(settings.METRICS, MULTIPROCESS_DIR=directory)):
+            first = registry.gather()
+            second = registry.gather()
+
+        self.assertFalse(os.path.exists(os.path.join(directory, f'{worker.pid}.json')))
+        own_cache_size = registry.collect()[('auth_user_cache_size', (), None)]
+        for samples in (first, second):
+            self.assertEqual(samples[('http_errors_total', (('view', 'x'), ('status', '500')), None)], 3)
+            self.assertEqual(samples[('auth_user_cache_size', (), None)], own_cache_size)
+
+
+class OrganisationETagTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email='etag@example.com',
+            password='password123',
+            firstName='ETag',
+            lastName='User'
+        )
+        self.other = User.objects.create_user(
+            email='other-etag@example.com',
+            password='password123',
+            firstName='Other',
+            lastName='User'
+        )
+        self.org = Organisation.objects.create(name="Polled Org")
+        self.org.users.add(self.user)
+        self.client.force_authenticate(user=self.user)
+        self.list_url = reverse('user-organisations')
+        self.single_url = reverse('single-organisation', args=[self.org.orgId])
+
+    def test_unchanged_organisation_is_answered_with_304_without_queries(self):
+        etag = self.client.get(self.single_url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.single_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # The version and the membership come from the organisation cache.
+        self.assertEqual(len(queries), 0)
+
+    def test_organisation_etag_changes_when_it_is_saved(self):
+        etag = self.client.get(self.single_url)['ETag']
+        self.org.name = "Renamed Org"
+        self.org.save()
+
+        response = self.client.get(self.single_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['data']['name'], "Renamed Org")
+
+    def test_non_members_get_403_not_304(self):
+        etag = self.client.get(self.single_url)['ETag']
+        self.client.force_authenticate(user=self.other)
+
+        self.assertEqual(self.client.get(self.single_url, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+
+    def test_list_etag_follows_membership_and_organisation_changes(self):
+        etag = self.client.get(self.list_url)['ETag']
+        self.assertEqual(self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        changes = [
+            lambda: Organisation.objects.create(name="Joined Org").users.add(self.user),
+            lambda: self.user.organisations.remove(self.org),
+            lambda: Organisation.objects.get(name="Joined Org").save(),
+            lambda: Organisation.objects.get(name="Joined Org").delete(),
+        ]
+        for change in changes:
+            change()
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+    def test_list_etag_depends_on_the_page(self):
+        self.assertNotEqual(self.client.get(self.list_url)['ETag'],
+                            self.client.get(self.list_url, {'limit': 1})['ETag'])
+
+
+class OrganisationCacheTestCase(TestCase):
+    def setUp(self):
+        organisation_cache.backend.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email='cached-org@example.com',
+            password='password123',
+            firstName='Cached',
+            lastName='Member'
+        )
+        self.outsider = User.objects.create_user(
+            email='outsider@example.com',
+            password='password123',
+            firstName='Out',
+            lastName='Sider'
+        )
+        self.org = Organisation.objects.create(name="Cached Org")
+        self.org.users.add(self.user)
+        self.url = reverse('single-organisation', args=[self.org.orgId])
+
+    def _get(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.get(self.url)
+
+    def test_second_read_is_served_from_the_cache(self):
+        self._get(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self._get(self.user)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['name'], "Cached Org")
+        self.assertEqual(len(queries), 0)
+        self.assertGreater(organisation_cache.hit_ratios()['single-organisation']['organisation'], 0)
+
+    def test_save_invalidates_the_payload(self):
+        self._get(self.user)
+        self.org.description = "Updated"
+        self.org.save()
+
+        self.assertEqual(self._get(self.user).json()['data']['description'], "Updated")
+
+    def test_membership_is_cached_per_user_without_loading_the_members(self):
+        self._get(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self._get(self.outsider).status_code, 403)
+
+        self.assertEqual(len(queries), 1)
+        self.assertIn('LIMIT 1', queries[0]['sql'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self._get(self.outsider).status_code, 403)
+
+    def test_membership_changes_invalidate_the_membership_flags(self):
+        self.assertEqual(self._get(self.outsider).status_code, 403)
+
+        self.outsider.organisations.add(self.org)
+        self.assertEqual(self._get(self.outsider).status_code, 200)
+
+        self.org.users.remove(self.outsider)
+        self.assertEqual(self._get(self.outsider).status_code, 403)
+
+    def test_delete_invalidates_everything(self):
+        self._get(self.user)
+        self.org.delete()
+
+        self.assertEqual(self._get(self.user).status_code, 404)
+
+    def test_org_id_is_normalised_before_it_is_used_as_a_key(self):
+        self._get(self.user)
+        self.org.name = "Renamed"
+        self.org.save()
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('single-organisation', args=[str(self.org.orgId).upper()]))
+        self.assertEqual(response.json()['data']['name'], "Renamed")
+
+
+class OrganisationMembersTestCase(TestCase):
+    def setUp(self):
+        organisation_cache.backend.clear()
+        self.client = APIClient()
+        self.org = Organisation.objects.create(name="Listed Org")
+        self.members = [
+            User.objects.create_user(
+                email=f'member{i}@example.com',
+                password='password123',
+                firstName='Member',
+                lastName=str(i)
+            )
+            for i in range(5)
+        ]
+        self.org.users.add(*self.members)
+        self.outsider = User.objects.create_user(
+            email='not-a-member@example.com',
+            password='password123',
+            firstName='Not',
+            lastName='Member'
+        )
+        self.url = reverse('add-user-to-org', args=[self.org.orgId])
+
+    def test_pages_cover_every_member_once(self):
+        self.client.force_authenticate(user=self.members[0])
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()['data']
+            seen += [user['userId'] for user in data['users']]
+            cursor = data['nextCursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(sorted(seen), sorted(str(user.userId) for user in self.members))
+
+    def test_stream_returns_one_json_line_per_member(self):
+        self.client.force_authenticate(user=self.members[0])
+        response = self.client.get(self.url, {'stream': 'true'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        users = [json.loads(line) for line in lines]
+        self.assertEqual(sorted(user['email'] for user in users),
+                         sorted(user.email for user in self.members))
+
+    def test_non_member_is_forbidden(self):
+        self.client.force_authenticate(user=self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_members_are_authorised_by_their_membership_flag_alone(self):
+        self.client.force_authenticate(user=self.members[0])
+        with mock.patch.object(organisation_cache, 'organisation') as load_payload:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        load_payload.assert_not_called()
+
+    def test_unknown_organisation_is_not_found(self):
+        self.client.force_authenticate(user=self.members[0])
+        response = self.client.get(reverse('add-user-to-org', args=[uuid.uuid4()]))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_listing_requires_authentication(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_adding_a_single_user_is_still_open(self):
+        response = self.client.post(self.url, {'userId': str(self.outsider.userId)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.org.users.filter(pk=self.outsider.pk).exists())
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(
+            email='export-admin@example.com',
+            password='password123',
+            firstName='Export',
+            lastName='Admin',
+            is_staff=True
+        )
+        self.user, self.org = User.objects.register(
+            email='exported@example.com',
+            password='password123',
+            firstName='Exported',
+            lastName='User'
+        )
+        self.client.force_authenticate(user=self.admin)
+
+    def test_ndjson_export_streams_every_row(self):
+        response = self.client.get(reverse('export-table', args=['users', 'ndjson']))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        users = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(user['email'] for user in users),
+                         ['export-admin@example.com', 'exported@example.com'])
+        self.assertNotIn('password', users[0])
+
+    def test_csv_export_is_gzipped_when_accepted(self):
+        response = self.client.get(reverse('export-table', args=['memberships', 'csv']),
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        rows = list(csv.reader(io.StringIO(gzip.decompress(b''.join(response.streaming_content)).decode())))
+        self.assertEqual(rows, [['user_id', 'organisation_id'], [str(self.user.userId), str(self.org.orgId)]])
+
+    def test_exported_rows_are_counted_in_the_request_timings(self):
+        with self.assertLogs('core.timing', level='INFO') as logs:
+            response = self.client.get(reverse('export-table', args=['users', 'ndjson']))
+            b''.join(response.streaming_content)
+
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'export-table')
+        self.assertIn(f'desc="{record["queries"] - 1} queries"', response['Server-Timing'])
+
+    def test_export_is_admin_only(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.assertEqual(self.client.get(reverse('export-table', args=['users', 'ndjson'])).status_code, 403)
+
+    def test_watermark_is_set_back_by_the_margin(self):
+        with override_settings(EXPORT_WATERMARK_MARGIN=300):
+            mark = watermark()
+
+        self.assertLessEqual(mark, timezone.now() - timedelta(seconds=300))
+
+    @override_settings(EXPORT_WATERMARK_MARGIN=0)
+    def test_command_exports_only_changes_since_the_watermark(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state = os.path.join(directory, 'watermark')
+            call_command('export_directory', directory, '--watermark-file', state, stdout=io.StringIO())
+            with open(os.path.join(directory, 'users.ndjson')) as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+            other = Organisation.objects.create(name="Joined Later")
+            other.users.add(self.user)
+            call_command('export_directory', directory, '--watermark-file', state, '--gzip',
+                         stdout=io.StringIO())
+
+            with gzip.open(os.path.join(directory, 'users.ndjson.gz')) as f:
+                users = [json.loads(line) for line in f]
+            with gzip.open(os.path.join(directory, 'memberships.ndjson.gz')) as f:
+                memberships = [json.loads(line) for line in f]
+
+        self.assertEqual([user['email'] for user in users], ['exported@example.com'])
+        self.assertEqual(sorted(m['organisation_id'] for m in memberships),
+                         sorted([str(self.org.orgId), str(other.orgId)]))
+
+
+class MembershipCounterTestCase(TestCase):
+    def setUp(self):
+        organisation_cache.backend.clear()
+        self.user, self.org = User.objects.register(
+            email='counted@example.com',
+            password='password123',
+            firstName='Counted',
+            lastName='User'
+        )
+        self.others = [
+            User.objects.create_user(
+                email=f'counted{i}@example.com',
+                password='password123',
+                firstName='Other',
+                lastName=str(i)
+            )
+            for i in range(3)
+        ]
+
+    def _counts(self):
+        self.org.refresh_from_db()
+        return self.org.memberCount, [user.organisationCount for user in User.objects.order_by('email')]
+
+    def test_registration_sets_the_counters(self):
+        self.assertEqual(self._counts(), (1, [0, 0, 0, 1]))
+
+    def test_add_remove_and_clear_keep_the_counters_in_step(self):
+        self.org.users.add(*self.others)
+        self.org.users.add(self.others[0])
+        self.assertEqual(self._counts(), (4, [1, 1, 1, 1]))
+
+        self.org.users.remove(self.others[0], self.others[0].pk, uuid.uuid4())
+        self.assertEqual(self._counts(), (3, [0, 1, 1, 1]))
+
+        self.others[1].organisations.clear()
+        self.assertEqual(self._counts(), (2, [0, 0, 1, 1]))
+
+        self.org.users.clear()
+        self.assertEqual(self._counts(), (0, [0, 0, 0, 0]))
+
+    def test_concurrent_adds_of_the_same_member_count_it_once(self):
+        self.org.users.add(self.others[0])
+        # The second add looked for missing members before the first one
+        # committed, so it still thinks others[0] has to be inserted.
+        with mock.patch.object(type(self.org.users), '_get_missing_target_ids',
+                               lambda manager, source, target, db, ids: set(ids)):
+            self.org.users.add(self.others[0])
+
+        self.assertEqual(self._counts(), (2, [1, 0, 0, 1]))
+
+    def test_bulk_add_and_deletes_keep_the_counters_in_step(self):
+        self.org.add_members([user.userId for user in self.others])
+        self.assertEqual(self._counts(), (4, [1, 1, 1, 1]))
+
+        self.others[0].delete()
+        self.org.refresh_from_db()
+        self.assertEqual(self.org.memberCount, 3)
+
+        self.org.delete()
+        self.assertEqual(User.objects.get(pk=self.others[1].pk).organisationCount, 0)
+
+    def test_own_detail_from_the_database_includes_the_organisation_count(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+
+        response = client.get(reverse('get_user_detail', args=[str(self.user.userId)]))
+        self.assertEqual(response.json()['data']['organisationCount'], 1)
+
+    def test_counts_are_served_and_change_the_etag(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('single-organisation', args=[self.org.orgId])
+        first = client.get(url)
+        self.assertEqual(first.json()['data']['memberCount'], 1)
+
+        self.org.users.add(self.others[0])
+        second = client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['data']['memberCount'], 2)
+
+    def test_stale_instance_save_keeps_the_counter(self):
+        stale = Organisation.objects.get(pk=self.org.pk)
+        self.org.users.add(*self.others)
+        stale.name = "Renamed"
+        stale.save()
+
+        self.assertEqual(self._counts()[0], 4)
+
+    def test_recount_fixes_drift(self):
+        Organisation.objects.filter(pk=self.org.pk).update(memberCount=7)
+        User.objects.filter(pk=self.others[0].pk).update(organisationCount=2)
+
+        out = io.StringIO()
+        call_command('recount', stdout=out)
+
+        self.assertIn('organisations: 1 drifted', out.getvalue())
+        self.assertIn('users: 1 drifted', out.getvalue())
+        self.assertEqual(self._counts(), (1, [0, 0, 0, 1]))
+
+
+class UUID7TestCase(TestCase):
+    def test_keys_are_version_7_and_sort_in_generation_order(self):
+        keys = [uuid7() for _ in range(10000)]
+
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual({key.version for key in keys}, {7})
+        self.assertEqual({key.variant for key in keys}, {uuid.RFC_4122})
+
+    def test_timestamp_is_the_creation_time(self):
+        before = int(timezone.now().timestamp() * 1000)
+        key = uuid7()
+
+        self.assertLessEqual(abs((key.int >> 80) - before), 1000)
+
+    def test_new_rows_are_keyed_in_creation_order(self):
+        user = User.objects.create_user(
+            email='ordered@example.com',
+            password='password123',
+            firstName='Ordered',
+            lastName='User'
+        )
+        organisations = [Organisation.objects.create(name=f"Org {i}") for i in range(5)]
+
+        self.assertEqual(user.userId.version, 7)
+        self.assertEqual(list(Organisation.objects.order_by('orgId')), organisations)
+
+
+class CaseInsensitiveEmailTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user, _ = User.objects.register(
+            email='Mixed.Case@Example.com',
+            password='password123',
+            firstName='Mixed',
+            lastName='Case'
+        )
+
+    def test_login_ignores_case_and_loads_only_the_login_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login_user'), {
+                'email': 'mixed.case@example.COM',
+                'password': 'password123'
+            }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['user']['userId'], str(self.user.userId))
+        lookup = queries[0]['sql']
+        self.assertIn('LOWER("user_user"."email")', lookup)
+        self.assertNotIn('organisationCount', lookup)
+        self.assertNotIn('membership_version', lookup)
+
+    def test_registration_rejects_a_case_variant(self):
+        response = self.client.post(reverse('register_user'), {
+            'firstName': 'Other',
+            'lastName': 'Case',
+            'email': 'mixed.case@example.com',
+            'password': 'password123',
+            'phone': '0700000000'
+        }, format='json')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['errors'][0]['field'], 'email')
+
+    def test_bulk_registration_rejects_case_variants(self):
+        results = list(register_users([
+            {'firstName': 'A', 'lastName': 'A', 'email': 'MIXED.case@example.com', 'password': 'password123',
+             'phone': '0700000000'},
+            {'firstName': 'B', 'lastName': 'B', 'email': 'new@example.com', 'password': 'password123',
+             'phone': '0700000000'},
+            {'firstName': 'C', 'lastName': 'C', 'email': 'NEW@example.com', 'password': 'password123',
+             'phone': '0700000000'},
+        ]))
 
+        self.assertEqual([result['result'] for result in results], ['duplicate', 'created', 'duplicate'])
@@ -0,0 +1,38 @@
+"""
+Settings for tests/replica_spec.py: the primary and a read replica are two
+local SQLite files, so reads that go to the wrong one are visible.
+
+    DJANGO_SETTINGS_MODULE=tests.replica_settings python manage.py test tests.replica_spec
+"""
+
+import tempfile
+from pathlib import Path
+
+from hng_stage2.settings import *
+
+
+_DIRECTORY = Path(tempfile.gettempdir())
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': _DIRECTORY / 'hng_stage2_primary.sqlite3',
+        'TEST': {'NAME': _DIRECTORY / 'test_hng_stage2_primary.sqlite3'},
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': _DIRECTORY / 'hng_stage2_replica.sqlite3',
+        'TEST': {'NAME': _DIRECTORY / 'test_hng_stage2_replica.sqlite3'},
+    },
+}
+
+# The sticky users have to be shared between processes.
+CACHES = {
+    **CACHES,
+    'replica-sticky': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': _DIRECTORY / 'hng_stage2_replica_sticky',
+    },
+}
+
+REPLICAS = {**REPLICAS, 'ALIASES': ['replica']}
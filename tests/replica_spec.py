@@ -0,0 +1,115 @@
+"""
+Read-replica routing (core.db_router), against a primary and a replica kept
+in two SQLite files. Run with:
+
+    DJANGO_SETTINGS_MODULE=tests.replica_settings python manage.py test tests.replica_spec
+"""
+
+import json
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import db_router
+from core.middleware import ReplicaRoutingMiddleware
+from core.organisation_cache import organisation_cache
+from core.user_cache import user_cache
+from user.models import Organisation, User
+
+
+@skipUnless(settings.REPLICAS['ALIASES'] == ['replica'], "run with tests.replica_settings")
+class ReplicaRoutingTestCase(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        user_cache.clear()
+        organisation_cache.backend.clear()
+        caches[settings.REPLICAS['CACHE']].clear()
+        self.client = APIClient()
+        self.user, self.org = User.objects.register(
+            email='primary@example.com',
+            password='password123',
+            firstName='Primary',
+            lastName='User'
+        )
+        self.other = User.objects.create_user(
+            email='colleague@example.com',
+            password='password123',
+            firstName='Colleague',
+            lastName='Replicated'
+        )
+        self.org.users.add(self.other)
+
+        # Copy every row to the replica, then change one on the primary only,
+        # as if the replica were lagging behind.
+        for model in (User, Organisation, Organisation.users.through):
+            model._default_manager.using('replica').bulk_create(model._default_manager.all())
+        User.objects.filter(pk=self.other.pk).update(lastName='Updated')
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.user.token}')
+        self.detail_url = reverse('get_user_detail', args=[str(self.other.userId)])
+
+    def test_router_reads_from_the_replica_only_inside_safe_requests(self):
+        router = db_router.ReplicaRouter()
+        self.assertEqual(router.db_for_read(User), 'default')
+
+        with db_router.routing(use_replicas=True):
+            self.assertEqual(router.db_for_read(User), 'replica')
+            with db_router.use_primary():
+                self.assertEqual(router.db_for_read(User), 'default')
+            router.db_for_write(User)
+            self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_one_replica_serves_every_read_of_a_request(self):
+        router = db_router.ReplicaRouter()
+        with override_settings(REPLICAS={**settings.REPLICAS, 'ALIASES': ['replica', 'default']}):
+            for _ in range(5):
+                with db_router.routing(use_replicas=True):
+                    self.assertEqual(len({router.db_for_read(User) for _ in range(20)}), 1)
+
+    def test_a_local_memory_sticky_cache_is_refused(self):
+        with override_settings(REPLICAS={**settings.REPLICAS, 'CACHE': 'default'}):
+            with self.assertRaises(ImproperlyConfigured):
+                ReplicaRoutingMiddleware(lambda request: None)
+
+    def test_safe_requests_read_from_the_replica(self):
+        response = self.client.get(self.detail_url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['lastName'], 'Replicated')
+
+    def test_streamed_members_are_read_from_the_replica(self):
+        response = self.client.get(reverse('add-user-to-org', args=[str(self.org.orgId)]), {'stream': 'true'})
+
+        users = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertIn('Replicated', {user['lastName'] for user in users})
+
+    def test_writer_reads_from_the_primary_afterwards(self):
+        response = self.client.post(reverse('user-organisations'),
+                                    {'name': "New Org", 'description': "Written to the primary"}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        self.assertTrue(db_router.is_sticky(self.user.pk))
+        self.assertEqual(self.client.get(self.detail_url).json()['data']['lastName'], 'Updated')
+
+    def test_new_user_reads_their_own_rows_from_the_primary(self):
+        response = self.client.post(reverse('register_user'), {
+            'firstName': 'Fresh',
+            'lastName': 'User',
+            'email': 'fresh@example.com',
+            'password': 'password123',
+            'phone': '0700000000'
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['data']['accessToken']}")
+        response = self.client.get(reverse('user-organisations'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([org['name'] for org in response.json()['data']['organisations']],
+                         ["Fresh's Organisation"])
@@ -0,0 +1,14 @@
+"""
+Async counterparts of the routes in user/urls.py, mounted under /async/.
+"""
+from django.urls import path
+
+from . import async_views
+
+urlpatterns = [
+    path('auth/register', async_views.register_user, name='async-register-user'),
+    path('auth/login', async_views.login_user, name='async-login-user'),
+    path('api/users/<str:id>', async_views.get_user_detail, name='async-user-detail'),
+    path('api/organisations', async_views.get_user_organisations, name='async-user-organisations'),
+    path('api/organisations/<str:orgId>', async_views.get_single_organisation, name='async-single-organisation'),
+]
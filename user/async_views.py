@@ -0,0 +1,267 @@
+"""
+Native async versions of the auth, organisation and user-detail endpoints,
+served under /async/ (see user/async_urls.py).
+
+DRF views are sync only, so these are plain Django async views. They return
+the same bodies and status codes as their counterparts in user/views.py, but
+use the async ORM and await the password hashing pool, so a single ASGI worker
+can hold many DB-bound requests at once.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+
+from core import hashing
+from core.custom_authentication import async_authentication_required
+from core.exceptions import HashingBusyError
+from core.organisation_cache import organisation_cache
+
+from .etags import not_modified, organisation_etag, organisations_etag, organisations_state
+from .models import User, Organisation
+from .pagination import apaginate
+from .serializers import (CredentialsSerializer, LoginSerializer, OrganisationSerializer,
+                          OrganisationValuesSerializer, PageSerializer, RegisterSerializer,
+                          UserDetailValuesSerializer)
+from .views import membership, parse_org_id, shares_organisation_with
+
+
+def _errors_response(errors):
+    return JsonResponse({
+        "errors": [{"field": k, "message": str(v[0])} for k, v in errors.items()]
+    }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+def _client_error_response():
+    return JsonResponse({
+        "status": "Bad request",
+        "message": "Client error",
+        "statusCode": 400
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+
+async def _aload_organisation(org_id):
+    row = await OrganisationValuesSerializer.rows(Organisation.objects.filter(orgId=org_id), 'version').afirst()
+    return None if row is None else (row[-1], OrganisationValuesSerializer.to_representation(row))
+
+
+def _register(data):
+    serializer = RegisterSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+    return serializer.data
+
+
+@csrf_exempt
+@require_POST
+async def register_user(request):
+    """
+    Register a user
+    """
+    data = _json_body(request)
+    if data is None:
+        return _client_error_response()
+
+    try:
+        # Validation and the inserts run in one transaction on the ORM's
+        # thread; the password hash inside it still goes to the hashing pool.
+        user = await sync_to_async(_register)(data)
+    except ValidationError as e:
+        return _errors_response(e.detail)
+    except HashingBusyError as e:
+        return JsonResponse(e.default_detail, status=e.status_code)
+    except Exception:
+        return JsonResponse({
+            "status": "Bad request",
+            "message": "Registration unsuccessful",
+            "statusCode": 400
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    return JsonResponse({
+        "status": "success",
+        "message": "Registration successful",
+        "data": {
+            "accessToken": user['token'],
+            "user": {field: user[field] for field in ('userId', 'firstName', 'lastName', 'email', 'phone')}
+        }
+    }, status=status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_POST
+async def login_user(request):
+    """
+    Log a user in using the email and password as the authentication credentials
+    """
+    data = _json_body(request)
+    if data is None:
+        return _client_error_response()
+
+    serializer = CredentialsSerializer(data=data)
+    if not serializer.is_valid():
+        return _errors_response(serializer.errors)
+    email = serializer.validated_data['email']
+    password = serializer.validated_data['password']
+
+    try:
+        user = await User.objects.by_email(email).only(*User.LOGIN_FIELDS).afirst()
+        if user is None:
+            # Hash anyway so that unknown emails take as long as wrong passwords.
+            await hashing.amake_password(password)
+            authenticated = False
+        else:
+            authenticated = await user.acheck_password(password) and user.is_active
+    except HashingBusyError as e:
+        return JsonResponse(e.default_detail, status=e.status_code)
+
+    if not authenticated:
+        return JsonResponse({
+            "status": "Bad request",
+            "message": "Authentication failed",
+            "statusCode": 401
+        }, status=status.HTTP_401_UNAUTHORIZED)
+
+    return JsonResponse(LoginSerializer().create({'user': user}), status=status.HTTP_200_OK)
+
+
+@require_GET
+@async_authentication_required
+async def get_user_detail(request, id):
+    """
+    Get a user's own record or user record in organisations they belong to or created
+    """
+    if str(request.user.userId) == id:
+        user = request.user
+        if 'organisationCount' in user.get_deferred_fields():
+            # Not carried in claims-only tokens; a deferred load would be a
+            # synchronous query.
+            await user.arefresh_from_db(fields=['organisationCount'])
+        data = {field: getattr(user, field) for field in UserDetailValuesSerializer.keys}
+    else:
+        try:
+            row = await UserDetailValuesSerializer.rows(
+                User.objects.filter(userId=id).annotate(shares_organisation=shares_organisation_with(request.user)),
+                'shares_organisation'
+            ).afirst()
+        except DjangoValidationError:
+            row = None
+        if row is None:
+            return JsonResponse({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        data = UserDetailValuesSerializer.to_representation(row)
+        if not row[-1]:
+            return JsonResponse({
+                "status": "error",
+                "message": "You do not have permission to view this user's details",
+                "statusCode": 403
+            }, status=status.HTTP_403_FORBIDDEN)
+
+    return JsonResponse({
+        "status": "success",
+        "message": "<message>",
+        "data": data
+    }, status=status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+@async_authentication_required
+async def get_user_organisations(request):
+    """
+    Get a page of the organisations the authenticated user belongs to, or
+    create a new organisation owned by them.
+    """
+    if request.method == 'GET':
+        page = PageSerializer(data=request.GET)
+        if not page.is_valid():
+            return _errors_response(page.errors)
+
+        cursor, limit = page.validated_data.get('cursor'), page.validated_data['limit']
+        etag = organisations_etag(request.user, await organisations_state(request.user).afirst(), cursor, limit)
+        if not_modified(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+
+        organisations, next_cursor = await apaginate(
+            OrganisationValuesSerializer.rows(Organisation.objects.filter(users=request.user.pk)), 'orgId',
+            after=cursor, limit=limit
+        )
+        return JsonResponse({
+            "status": "success",
+            "message": "<message>",
+            "data": {
+                "organisations": OrganisationValuesSerializer.many(organisations),
+                "nextCursor": next_cursor
+            }
+        }, status=status.HTTP_200_OK, headers={'ETag': etag})
+
+    data = _json_body(request)
+    if data is None:
+        return _client_error_response()
+    serializer = OrganisationSerializer(data=data)
+    if not serializer.is_valid():
+        return _client_error_response()
+
+    organisation = await Organisation.objects.acreate(**serializer.validated_data)
+    await organisation.users.aadd(request.user)
+    await organisation.arefresh_from_db(fields=['memberCount'])
+
+    return JsonResponse({
+        "status": "success",
+        "message": "Organisation created successfully",
+        "data": OrganisationSerializer(organisation).data
+    }, status=status.HTTP_201_CREATED)
+
+
+@require_GET
+@async_authentication_required
+async def get_single_organisation(request, orgId):
+    """
+    Get a single organisation record for the authenticated user.
+    """
+    try:
+        org_id = parse_org_id(orgId)
+    except Organisation.DoesNotExist:
+        org_id = None
+    entry = None
+    if org_id is not None:
+        endpoint = request.resolver_match.view_name
+        entry = await organisation_cache.aorganisation(org_id, lambda: _aload_organisation(org_id), endpoint)
+    if entry is None:
+        return JsonResponse({
+            "status": "error",
+            "message": "Organisation not found",
+            "statusCode": 404
+        }, status=status.HTTP_404_NOT_FOUND)
+    version, data = entry
+
+    user_id = request.user.pk
+    is_member = await organisation_cache.ais_member(
+        org_id, user_id, lambda: membership(org_id, user_id).aexists(), endpoint)
+    if not is_member:
+        return JsonResponse({
+            "status": "error",
+            "message": "You do not have permission to view this organisation",
+            "statusCode": 403
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    etag = organisation_etag(org_id, version)
+    if not_modified(request, etag):
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    return JsonResponse({
+        "status": "success",
+        "message": "<message>",
+        "data": data
+    }, status=status.HTTP_200_OK, headers={'ETag': etag})
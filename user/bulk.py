@@ -0,0 +1,128 @@
+"""
+Bulk user registration, shared by POST /auth/register/bulk and
+`manage.py import_users`.
+
+Rows are processed in chunks. For every chunk the already-registered emails
+are fetched with one query, the passwords are hashed on a password hashing
+executor (core.hashing), and the users, their default organisations and the
+memberships are written with three bulk inserts inside one transaction. An email registered by someone
+else between the lookup and the insert makes the transaction fail on the
+unique index; the chunk's taken emails are then looked up again, reported
+as duplicates and the rest inserted.
+"""
+
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+
+from core import hashing
+
+from .models import User, Organisation
+from .serializers import BulkUserSerializer
+
+
+def hash_passwords(passwords, executor=None):
+    """
+    Hash `passwords` on `executor`, the shared core.hashing executor by
+    default, so bulk registrations share its bounded queue and metrics.
+    """
+    return (executor or hashing.executor).map(make_password, passwords)
+
+
+def _registered(emails):
+    """
+    Which of the lowercased `emails` are already registered.
+    """
+    return set(
+        User.objects
+        .annotate(email_lower=Lower('email'))
+        .filter(email_lower__in=emails)
+        .values_list('email_lower', flat=True)
+    )
+
+
+def register_users(rows, executor=None, chunk_size=None):
+    """
+    Register every row in `rows` (an iterable of dicts with firstName,
+    lastName, email, phone and password), hashing the passwords on
+    `executor` (see hash_passwords). Yields one result dict per row, in
+    order, with `result` set to 'created', 'duplicate' or 'invalid'.
+    """
+    chunk_size = chunk_size or settings.BULK_REGISTER_CHUNK_SIZE
+    rows = iter(rows)
+    seen = set()
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from _register_chunk(chunk, executor, seen)
+
+
+def _register_chunk(chunk, executor, seen):
+    results = [None] * len(chunk)
+    candidates = []
+    for index, row in enumerate(chunk):
+        serializer = BulkUserSerializer(data=row)
+        if not serializer.is_valid():
+            results[index] = {
+                "email": row.get('email') if isinstance(row, dict) else None,
+                "result": "invalid",
+                "errors": [{"field": k, "message": str(v[0])} for k, v in serializer.errors.items()],
+            }
+            continue
+        data = serializer.validated_data
+        data['email'] = User.objects.normalize_email(data['email'])
+        # Emails are unique ignoring case (see User.Meta.constraints).
+        if data['email'].lower() in seen:
+            results[index] = {"email": data['email'], "result": "duplicate"}
+            continue
+        seen.add(data['email'].lower())
+        candidates.append((index, data))
+
+    registered = _registered([data['email'].lower() for _, data in candidates])
+    new = []
+    for index, data in candidates:
+        if data['email'].lower() in registered:
+            results[index] = {"email": data['email'], "result": "duplicate"}
+        else:
+            new.append((index, data))
+
+    hashes = hash_passwords([data.pop('password') for _, data in new], executor)
+    users = {index: User(password=password, organisationCount=1, **data)
+             for (index, data), password in zip(new, hashes)}
+
+    while users:
+        try:
+            _insert(list(users.values()))
+            break
+        except IntegrityError:
+            # Registered concurrently since the lookup above.
+            taken = _registered([user.email.lower() for user in users.values()])
+            if not taken:
+                raise
+            for index, user in list(users.items()):
+                if user.email.lower() in taken:
+                    results[index] = {"email": user.email, "result": "duplicate"}
+                    del users[index]
+
+    for index, user in users.items():
+        results[index] = {"email": user.email, "result": "created", "userId": str(user.userId)}
+    return results
+
+
+def _insert(users):
+    organisations = [Organisation.default_for(user) for user in users]
+    for organisation in organisations:
+        # bulk_create sends no m2m_changed, so the counters are set here.
+        organisation.memberCount = 1
+    membership = Organisation.users.through
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        Organisation.objects.bulk_create(organisations)
+        membership.objects.bulk_create([
+            membership(organisation_id=organisation.pk, user_id=user.pk)
+            for user, organisation in zip(users, organisations)
+        ])
@@ -0,0 +1,54 @@
+"""
+Strong ETags for the organisation endpoints, built from version counters so
+that a conditional GET can be answered without loading or serialising rows.
+
+    single organisation   Organisation.version
+    organisation list     the user's membership_version, plus the sum of the
+                          versions of their organisations, plus the page asked for
+
+Organisation versions only grow, and membership_version grows whenever the
+set of organisations changes, so the pair changes on every edit that could
+change the list.
+"""
+
+import hashlib
+
+from django.db.models import Sum
+from django.utils.http import parse_etags, quote_etag
+
+from .models import User
+
+
+def organisation_etag(org_id, version):
+    return quote_etag(f'org-{org_id}-{version}')
+
+
+def organisations_state(user):
+    """
+    The (membership_version, sum of organisation versions) row for `user`,
+    in one query.
+    """
+    return (User.objects
+            .filter(pk=user.pk)
+            .annotate(versions=Sum('organisations__version'))
+            .values_list('membership_version', 'versions'))
+
+
+def organisations_etag(user, state, cursor, limit):
+    membership_version, versions = state
+    key = f'{user.pk}:{membership_version}:{versions or 0}:{cursor or ""}:{limit}'
+    return quote_etag('orgs-' + hashlib.sha256(key.encode()).hexdigest()[:32])
+
+
+def not_modified(request, etag):
+    """
+    Whether the request's If-None-Match already names `etag`. Comparison is
+    weak, as RFC 9110 requires for If-None-Match.
+    """
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    if etags == ['*']:
+        return True
+    return etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in etags}
@@ -0,0 +1,123 @@
+"""
+Streaming exports of the users, organisations and membership tables, for
+`manage.py export_directory` and GET /api/export/<table>.
+
+Rows are read with .iterator(chunk_size=STREAMING_CHUNK_SIZE), which is a
+server-side cursor on PostgreSQL, and encoded as NDJSON or CSV as they
+arrive, optionally gzipped on the fly, so memory use does not grow with the
+table. Where server-side cursors are disabled (DB_CONNECTION_MODE=serverless)
+the driver would buffer the whole result, so the table is walked in keyset
+pages instead.
+
+An export `since` a watermark only holds the rows with an updated_at at or
+after it. Joining or leaving an organisation touches the user's updated_at
+(see user/signals.py), and the membership export of an incremental run holds
+every membership of the users that changed, so a consumer replaces each of
+those users' memberships wholesale. Deleted rows are not exported.
+
+Delivery is at least once. updated_at is stamped when a row is written, not
+when its transaction commits, so a row stamped just before an export starts
+can become visible only after the export has read past it. The watermark
+handed out for the next run is therefore EXPORT_WATERMARK_MARGIN seconds
+earlier than the start of this one, which has to exceed the longest write
+transaction, and each incremental export repeats the rows changed within
+that margin. Consumers upsert by primary key, so a repeated row is harmless.
+"""
+
+import csv
+import io
+import zlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from core.renderers import render_ndjson
+
+from .models import Organisation, User
+
+
+# table -> (model, exported columns, lookup compared with the watermark)
+TABLES = {
+    'users': (User, ('userId', 'firstName', 'lastName', 'email', 'phone', 'is_active', 'is_staff', 'updated_at'),
+              'updated_at'),
+    'organisations': (Organisation, ('orgId', 'name', 'description', 'updated_at'), 'updated_at'),
+    'memberships': (Organisation.users.through, ('user_id', 'organisation_id'), 'user__updated_at'),
+}
+
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def watermark():
+    """
+    The watermark to pass as `since` to the next export, taken before this
+    one starts reading and EXPORT_WATERMARK_MARGIN seconds early, so that
+    rows written meanwhile, or still uncommitted, are exported again rather
+    than missed.
+    """
+    return timezone.now() - timedelta(seconds=settings.EXPORT_WATERMARK_MARGIN)
+
+
+def export_rows(table, since=None, chunk_size=None):
+    """
+    (columns, iterator of row tuples) for `table`.
+    """
+    model, columns, changed = TABLES[table]
+    queryset = model._default_manager.all()
+    if since is not None:
+        queryset = queryset.filter(**{f'{changed}__gte': since})
+    return columns, _iterate(queryset, columns, chunk_size or settings.STREAMING_CHUNK_SIZE)
+
+
+def _iterate(queryset, columns, chunk_size):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or not connection.settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        yield from queryset.values_list(*columns).iterator(chunk_size=chunk_size)
+        return
+
+    queryset = queryset.values_list('pk', *columns).order_by('pk')
+    after = None
+    while True:
+        page = list((queryset if after is None else queryset.filter(pk__gt=after))[:chunk_size])
+        for row in page:
+            yield row[1:]
+        if len(page) < chunk_size:
+            return
+        after = page[-1][0]
+
+
+def encode(columns, rows, file_format):
+    """
+    Yield `rows` as NDJSON objects or CSV lines (after a header row), a
+    batch of rows at a time.
+    """
+    if file_format == 'ndjson':
+        return render_ndjson(dict(zip(columns, row)) for row in rows)
+    return _csv_lines(columns, rows)
+
+
+def _csv_lines(columns, rows, batch_size=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzipped(chunks):
+    """
+    Compress a stream of byte strings into one gzip stream as it goes.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,75 @@
+import itertools
+import uuid
+
+from core import hashing
+from user.models import User, Organisation
+
+
+BENCH_PASSWORD = 'bench-password-123'
+
+
+class Seed:
+    """
+    The benchmark dataset: `users` users that all share `organisations`
+    organisations, plus empty organisations for the add-user endpoint to fill.
+    Every row is tagged with the run id so it can be removed afterwards.
+    """
+
+    def __init__(self):
+        self.run = uuid.uuid4().hex[:12]
+        self.email_prefix = f'bench-{self.run}-'
+        self._registered = itertools.count()
+
+    def create(self, users, organisations, add_targets):
+        # One hash for every seeded user, so seeding does not cost a PBKDF2 run per row.
+        password = hashing.make_password(BENCH_PASSWORD)
+        # Every user joins every organisation below. bulk_create sends no
+        # m2m_changed, so the counters are set on insert.
+        self.users = User.objects.bulk_create(
+            User(email=f'{self.email_prefix}{i}@example.com', password=password,
+                 firstName='Bench', lastName=f'User {i}', phone='0800000000', organisationCount=organisations)
+            for i in range(users)
+        )
+        self.organisations = Organisation.objects.bulk_create(
+            Organisation(name=f'Bench {self.run} {i}', description='Benchmark organisation', memberCount=users)
+            for i in range(organisations)
+        )
+        self.add_targets = Organisation.objects.bulk_create(
+            Organisation(name=f'Bench {self.run} target {i}') for i in range(add_targets)
+        )
+        membership = Organisation.users.through
+        membership.objects.bulk_create(
+            membership(organisation_id=organisation.pk, user_id=user.pk)
+            for organisation in self.organisations for user in self.users
+        )
+        self.tokens = [user.token for user in self.users]
+
+    def request(self, endpoint, i):
+        """
+        (method, url args, body, headers) for the i-th request to `endpoint`.
+        """
+        user_index = i % len(self.users)
+        headers = {'Authorization': f'Bearer {self.tokens[user_index]}'}
+        if endpoint == 'register':
+            n = next(self._registered)
+            return 'post', [], {
+                'firstName': 'Bench', 'lastName': f'Registered {n}', 'phone': '0800000000',
+                'email': f'{self.email_prefix}registered-{n}@example.com', 'password': BENCH_PASSWORD,
+            }, {}
+        if endpoint == 'login':
+            return 'post', [], {'email': self.users[user_index].email, 'password': BENCH_PASSWORD}, {}
+        if endpoint == 'user-detail':
+            other = self.users[(user_index + 1) % len(self.users)]
+            return 'get', [str(other.userId)], None, headers
+        if endpoint == 'organisations':
+            return 'get', [], None, headers
+        if endpoint == 'single-organisation':
+            return 'get', [str(self.organisations[i % len(self.organisations)].orgId)], None, headers
+        # add-user: every (target, user) pair is used once, so each request adds a new member.
+        target = self.add_targets[i // len(self.users)]
+        return 'post', [str(target.orgId)], {'userId': str(self.users[user_index].userId)}, headers
+
+    def delete(self):
+        Organisation.objects.filter(name__startswith=f'Bench {self.run} ').delete()
+        Organisation.objects.filter(users__email__startswith=self.email_prefix).delete()
+        User.objects.filter(email__startswith=self.email_prefix).delete()
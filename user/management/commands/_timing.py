@@ -0,0 +1,108 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client, override_settings
+
+
+def summarise(latencies, elapsed):
+    """
+    Throughput and latency percentiles, in the shape every bench_* command
+    reports them, for a list of per-request latencies in seconds.
+    """
+    latencies = sorted(latencies)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(quantiles[49] * 1000, 2),
+        'p95_ms': round(quantiles[94] * 1000, 2),
+        'p99_ms': round(quantiles[98] * 1000, 2),
+    }
+
+
+def require_concurrent_database():
+    if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] in (':memory:', ''):
+        raise CommandError("Concurrent clients need a file-backed SQLite database or Postgres")
+
+
+def allow_test_clients():
+    """
+    Settings override letting through the host 'testserver', which the test
+    clients send their requests for.
+    """
+    return override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+
+
+def send_sync(client, method, path, body, headers):
+    if method == 'get':
+        return client.get(path, headers=headers)
+    return client.post(path, body, content_type='application/json', headers=headers)
+
+
+async def send_async(client, method, path, body, headers):
+    if method == 'get':
+        return await client.get(path, headers=headers)
+    return await client.post(path, body, content_type='application/json', headers=headers)
+
+
+def _check(response, path, expected):
+    if response.status_code != expected:
+        raise CommandError(f"{path} answered {response.status_code}, expected {expected}")
+
+
+def run_sync(build, expected, requests, concurrency):
+    """
+    Send `requests` requests through the WSGI handler from `concurrency`
+    threads, each with its own client. `build(i)` returns the
+    (method, path, body, headers) of the i-th request; any status code other
+    than `expected` stops the run with a CommandError.
+    """
+    indexes = range(requests)
+    chunks = [indexes[i::concurrency] for i in range(concurrency)]
+
+    def client_loop(chunk):
+        client = Client()
+        latencies = []
+        try:
+            for i in chunk:
+                method, path, body, headers = build(i)
+                started = time.perf_counter()
+                response = send_sync(client, method, path, body, headers)
+                latencies.append(time.perf_counter() - started)
+                _check(response, path, expected)
+        finally:
+            connections.close_all()
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = [latency for chunk in pool.map(client_loop, chunks) for latency in chunk]
+    return summarise(latencies, time.perf_counter() - started)
+
+
+async def run_async(build, expected, requests, concurrency):
+    """
+    `run_sync` through the ASGI handler, with at most `concurrency` requests
+    in flight on one event loop.
+    """
+    client = AsyncClient()
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one_request(i):
+        method, path, body, headers = build(i)
+        async with slots:
+            started = time.perf_counter()
+            response = await send_async(client, method, path, body, headers)
+            latencies.append(time.perf_counter() - started)
+            _check(response, path, expected)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_request(i) for i in range(requests)))
+    return summarise(latencies, time.perf_counter() - started)
@@ -0,0 +1,59 @@
+import json
+import pstats
+import statistics
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import stored
+
+
+class Command(BaseCommand):
+    help = "Merge the stored request profiles per endpoint and list the hottest functions of each"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Profile directory; PROFILING['DIR'] when omitted")
+        parser.add_argument('--endpoint', action='append',
+                            help="Only this endpoint (URL name); can be repeated")
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--sort', choices=['tottime', 'cumtime'], default='tottime',
+                            help="tottime ranks by time spent in the function itself, cumtime includes callees")
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        by_endpoint = defaultdict(list)
+        for endpoint, latency, path in stored(options['dir']):
+            if not options['endpoint'] or endpoint in options['endpoint']:
+                by_endpoint[endpoint].append((latency, path))
+        if not by_endpoint:
+            raise CommandError("No profiles found")
+
+        report = {endpoint: self._aggregate(profiles, options) for endpoint, profiles in sorted(by_endpoint.items())}
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for endpoint, summary in report.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{endpoint}: {summary['profiles']} profiles, median {summary['median_latency_ms']} ms"
+            ))
+            self.stdout.write(f"{'calls':>10} {'tottime':>10} {'cumtime':>10}  function")
+            for row in summary['functions']:
+                self.stdout.write(f"{row['calls']:>10} {row['tottime_ms']:>10} {row['cumtime_ms']:>10}  "
+                                  f"{row['function']}")
+
+    def _aggregate(self, profiles, options):
+        stats = pstats.Stats(*(str(path) for _, path in profiles))
+        column = 2 if options['sort'] == 'tottime' else 3
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)[:options['top']]
+        return {
+            'profiles': len(profiles),
+            'median_latency_ms': statistics.median(latency for latency, _ in profiles),
+            'functions': [{
+                'function': f"{filename}:{line}({name})",
+                'calls': calls,
+                # Per profiled request, so endpoints with more profiles compare fairly.
+                'tottime_ms': round(tottime / len(profiles) * 1000, 3),
+                'cumtime_ms': round(cumtime / len(profiles) * 1000, 3),
+            } for (filename, line, name), (_, calls, tottime, cumtime, _) in rows],
+        }
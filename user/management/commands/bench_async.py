@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from ._seed import Seed
+from ._timing import allow_test_clients, require_concurrent_database, run_async, run_sync
+
+
+ENDPOINTS = {
+    'organisations': ('user-organisations', 'async-user-organisations'),
+    'single-organisation': ('single-organisation', 'async-single-organisation'),
+    'user-detail': ('get_user_detail', 'async-user-detail'),
+}
+
+
+class Command(BaseCommand):
+    help = ("Compare throughput of the sync (WSGI) and async (ASGI) versions of an endpoint "
+            "under concurrent clients, in-process against the configured database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='organisations')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--organisations', type=int, default=20,
+                            help="Organisations the benchmark users belong to")
+
+    def handle(self, *args, **options):
+        require_concurrent_database()
+
+        seed = Seed()
+        try:
+            seed.create(users=2, organisations=options['organisations'], add_targets=0)
+            sync_name, async_name = ENDPOINTS[options['endpoint']]
+
+            def build(url_name):
+                def request(i):
+                    method, args, body, headers = seed.request(options['endpoint'], i)
+                    return method, reverse(url_name, args=args), body, headers
+                return request
+
+            with allow_test_clients():
+                results = {
+                    'endpoint': options['endpoint'],
+                    'concurrency': options['concurrency'],
+                    'wsgi': run_sync(build(sync_name), 200, options['requests'], options['concurrency']),
+                    'asgi': asyncio.run(run_async(build(async_name), 200, options['requests'],
+                                                  options['concurrency'])),
+                }
+        finally:
+            seed.delete()
+
+        self.stdout.write(json.dumps(results, indent=2))
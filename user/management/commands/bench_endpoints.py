@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.organisation_cache import organisation_cache
+from user.models import Organisation
+
+from ._seed import Seed
+from ._timing import allow_test_clients, require_concurrent_database, run_async, run_sync, send_sync
+
+
+# name -> (sync url name, async url name or None, expected status code)
+ENDPOINTS = {
+    'register': ('register_user', 'async-register-user', 201),
+    'login': ('login_user', 'async-login-user', 200),
+    'user-detail': ('get_user_detail', 'async-user-detail', 200),
+    'organisations': ('user-organisations', 'async-user-organisations', 200),
+    'single-organisation': ('single-organisation', 'async-single-organisation', 200),
+    'add-user': ('add-user-to-org', None, 200),
+}
+
+
+class Command(BaseCommand):
+    help = ("Seed a dataset and drive the API endpoints with concurrent clients through the WSGI or ASGI "
+            "handler, in-process. Prints throughput, p50/p95/p99 latency and queries per request as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handler', choices=['wsgi', 'asgi'], default='wsgi',
+                            help="asgi uses the /async/ views where they exist")
+        parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint")
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--users', type=int, default=50, help="Seeded users")
+        parser.add_argument('--organisations', type=int, default=20,
+                            help="Seeded organisations, every seeded user belongs to all of them")
+        parser.add_argument('--output', help="Also write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        require_concurrent_database()
+        if connection.vendor == 'sqlite' and options['concurrency'] > 1 and 'add-user' in options['endpoints']:
+            # SQLite takes one writer at a time; the other concurrent adds
+            # fail on the database lock, which the view answers with a 400.
+            raise CommandError("add-user cannot be benchmarked concurrently on SQLite, "
+                               "use Postgres or --concurrency 1")
+        if options['users'] < 2 or options['organisations'] < 1:
+            raise CommandError("Seed at least 2 users and 1 organisation")
+
+        seed = Seed()
+        report = {
+            'handler': options['handler'],
+            'database': connection.vendor,
+            'concurrency': options['concurrency'],
+            'seed': {'users': options['users'], 'organisations': options['organisations']},
+            'endpoints': {},
+        }
+        try:
+            seed.create(options['users'], options['organisations'],
+                        add_targets=-(-options['requests'] // options['users']))
+            with allow_test_clients():
+                for endpoint in options['endpoints']:
+                    self.stderr.write(f"{endpoint}...")
+                    report['endpoints'][endpoint] = self._bench(seed, endpoint, options)
+        finally:
+            seed.delete()
+        report['organisation_cache_hit_ratios'] = organisation_cache.hit_ratios()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def _bench(self, seed, endpoint, options):
+        sync_name, async_name, expected = ENDPOINTS[endpoint]
+        use_async = options['handler'] == 'asgi' and async_name is not None
+        url_name = async_name if use_async else sync_name
+
+        def build(i):
+            method, args, body, headers = seed.request(endpoint, i)
+            return method, reverse(url_name, args=args), body, headers
+
+        if options['handler'] == 'asgi':
+            result = asyncio.run(run_async(build, expected, options['requests'], options['concurrency']))
+        else:
+            result = run_sync(build, expected, options['requests'], options['concurrency'])
+        result['queries_per_request'] = self._queries_per_request(seed, endpoint, build, options)
+        result['url'] = reverse(url_name, args=seed.request(endpoint, 0)[1])
+        return result
+
+    def _queries_per_request(self, seed, endpoint, build, options):
+        """
+        Queries per request do not depend on the handler or on concurrency,
+        so they are counted afterwards on a few sequential requests.
+        """
+        membership = Organisation.users.through
+        client = Client()
+        counts = []
+        for i in range(min(5, options['requests'])):
+            method, path, body, headers = build(i)
+            if endpoint == 'add-user':
+                # Undo the timed run's insert so the request adds a member again.
+                target = seed.add_targets[i // len(seed.users)]
+                membership.objects.filter(organisation_id=target.pk, user_id=body['userId']).delete()
+            with CaptureQueriesContext(connection) as captured:
+                send_sync(client, method, path, body, headers)
+            counts.append(len(captured))
+        return round(sum(counts) / len(counts), 2)
@@ -0,0 +1,73 @@
+import io
+import json
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer, use_orjson
+from user.models import User, Organisation
+from user.serializers import LoginSerializer, OrganisationSerializer
+
+
+class Command(BaseCommand):
+    help = ("Micro-benchmark DRF's JSON renderer/parser against core.renderers.FastJSONRenderer and "
+            "core.parsers.FastJSONParser on the organisation list and login payloads. No database needed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisations', type=int, default=1000,
+                            help="Organisations in the GET /api/organisations payload")
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if not use_orjson():
+            raise CommandError("orjson is not installed or JSON_BACKEND is not 'orjson'")
+
+        organisations = [
+            Organisation(name=f"Organisation {i}", description=f"Description of organisation {i}")
+            for i in range(options['organisations'])
+        ]
+        organisations_payload = {
+            "status": "success",
+            "message": "<message>",
+            "data": {
+                "organisations": OrganisationSerializer(organisations, many=True).data,
+                "nextCursor": None
+            }
+        }
+        user = User(email='john@example.com', firstName='John', lastName='Doe', phone='07055534343')
+        login_payload = LoginSerializer().create({'user': user})
+        login_body = json.dumps({'email': 'john@example.com', 'password': 'securepassword123'}).encode()
+
+        repeat = options['repeat']
+        results = {
+            'organisations': options['organisations'],
+            'repeat': repeat,
+            'render_organisations': self._compare(
+                lambda: JSONRenderer().render(organisations_payload),
+                lambda: FastJSONRenderer().render(organisations_payload),
+                repeat,
+            ),
+            'render_login': self._compare(
+                lambda: JSONRenderer().render(login_payload),
+                lambda: FastJSONRenderer().render(login_payload),
+                repeat * 50,
+            ),
+            'parse_login': self._compare(
+                lambda: JSONParser().parse(io.BytesIO(login_body)),
+                lambda: FastJSONParser().parse(io.BytesIO(login_body)),
+                repeat * 50,
+            ),
+        }
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _compare(self, stock, fast, number):
+        stock_seconds = min(timeit.repeat(stock, number=number, repeat=3))
+        fast_seconds = min(timeit.repeat(fast, number=number, repeat=3))
+        return {
+            'drf_us': round(stock_seconds / number * 1e6, 2),
+            'fast_us': round(fast_seconds / number * 1e6, 2),
+            'speedup': round(stock_seconds / fast_seconds, 2),
+        }
@@ -0,0 +1,75 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from user.models import User, Organisation
+from user.serializers import OrganisationSerializer, OrganisationValuesSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Time OrganisationSerializer against OrganisationValuesSerializer for a user with many "
+            "organisations. The seed data is written inside a transaction that is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisations', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    email=f'bench-{uuid.uuid4().hex}@example.com',
+                    password=uuid.uuid4().hex,
+                    firstName='Bench',
+                    lastName='User',
+                    organisationCount=options['organisations']
+                )
+                # The memberships are bulk inserted, without m2m_changed, so
+                # the counters are set on insert.
+                organisations = Organisation.objects.bulk_create(
+                    Organisation(name=f"Bench Org {i}", description=f"Description of organisation {i}",
+                                 memberCount=1)
+                    for i in range(options['organisations'])
+                )
+                Organisation.users.through.objects.bulk_create(
+                    Organisation.users.through(organisation_id=o.pk, user_id=user.pk) for o in organisations
+                )
+
+                queryset = user.organisations.all()
+                results = {
+                    'organisations': options['organisations'],
+                    'repeat': options['repeat'],
+                    'model_serializer': self._time(
+                        lambda: OrganisationSerializer(queryset.all(), many=True).data, options['repeat']),
+                    'values_serializer': self._time(
+                        lambda: OrganisationValuesSerializer.many(OrganisationValuesSerializer.rows(queryset.all())),
+                        options['repeat']),
+                }
+                results['speedup'] = round(results['model_serializer']['best_ms']
+                                           / results['values_serializer']['best_ms'], 2)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _time(self, fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - started)
+        return {
+            'best_ms': round(min(timings) * 1000, 2),
+            'mean_ms': round(sum(timings) / len(timings) * 1000, 2),
+            'queries': len(queries),
+        }
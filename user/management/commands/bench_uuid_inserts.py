@@ -0,0 +1,69 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.ids import uuid7
+from user.models import Organisation
+
+
+GENERATORS = {'uuid4': uuid.uuid4, 'uuid7': uuid7}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Time bulk inserts of organisations keyed by uuid4 against uuid7 and, on PostgreSQL, "
+            "measure how much each grows the primary key index. Every run is rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        results = {'rows': options['rows'], 'batch_size': options['batch_size'], 'vendor': connection.vendor}
+        for name, generate in GENERATORS.items():
+            results[name] = self._run(generate, options['rows'], options['batch_size'])
+        results['speedup'] = round(results['uuid4']['seconds'] / results['uuid7']['seconds'], 2)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _run(self, generate, rows, batch_size):
+        index = self._primary_key_index()
+        try:
+            with transaction.atomic():
+                size_before = self._index_size(index)
+                started = time.perf_counter()
+                for start in range(0, rows, batch_size):
+                    Organisation.objects.bulk_create(
+                        Organisation(orgId=generate(), name=f"Bench Org {i}", description="")
+                        for i in range(start, min(start + batch_size, rows))
+                    )
+                elapsed = time.perf_counter() - started
+                size_after = self._index_size(index)
+                raise Rollback
+        except Rollback:
+            pass
+
+        result = {'seconds': round(elapsed, 3), 'rows_per_second': round(rows / elapsed, 1)}
+        if size_before is not None:
+            result['index_growth_bytes'] = size_after - size_before
+            result['index_bytes_per_row'] = round((size_after - size_before) / rows, 1)
+        return result
+
+    def _primary_key_index(self):
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Organisation._meta.db_table)
+        return next(name for name, constraint in constraints.items() if constraint['primary_key'])
+
+    def _index_size(self, index):
+        if index is None:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_relation_size(%s::regclass)', [connection.ops.quote_name(index)])
+            return cursor.fetchone()[0]
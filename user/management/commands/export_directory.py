@@ -0,0 +1,69 @@
+import os
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from user.export import TABLES, encode, export_rows, gzipped, watermark
+
+
+class Command(BaseCommand):
+    help = "Export users, organisations and memberships as NDJSON or CSV files, streaming from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory the <table>.<format>[.gz] files are written to")
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help="Gzip the files as they are written")
+        parser.add_argument('--tables', nargs='+', choices=list(TABLES), default=list(TABLES))
+        parser.add_argument('--since', help="Only export rows changed at or after this ISO 8601 timestamp")
+        parser.add_argument('--watermark-file',
+                            help="Read --since from this file when it exists, and store the watermark "
+                                 "for the next run in it once the export has succeeded")
+        parser.add_argument('--chunk-size', type=int, help="Rows fetched per round trip")
+
+    def handle(self, *args, **options):
+        since = options['since']
+        state = Path(options['watermark_file']) if options['watermark_file'] else None
+        if since is None and state is not None and state.exists():
+            since = state.read_text().strip()
+        if since is not None:
+            parsed = parse_datetime(since)
+            if parsed is None:
+                raise CommandError(f"Invalid --since timestamp: {since}")
+            since = parsed
+
+        directory = Path(options['directory'])
+        directory.mkdir(parents=True, exist_ok=True)
+        next_watermark = watermark()
+
+        for table in options['tables']:
+            columns, rows = export_rows(table, since=since, chunk_size=options['chunk_size'])
+            counted = _Counted(rows)
+            chunks = encode(columns, counted, options['format'])
+            path = directory / f"{table}.{options['format']}"
+            if options['gzip']:
+                chunks, path = gzipped(chunks), path.with_name(path.name + '.gz')
+
+            # Written under a temporary name so a failed run leaves the last
+            # complete export in place.
+            partial = path.with_name(path.name + '.partial')
+            with open(partial, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(partial, path)
+            self.stdout.write(f"{table}: {counted.count} rows -> {path}")
+
+        if state is not None:
+            state.write_text(next_watermark.isoformat() + '\n')
+        self.stdout.write(self.style.SUCCESS(f"watermark {next_watermark.isoformat()}"))
+
+
+class _Counted:
+    def __init__(self, rows):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
@@ -0,0 +1,48 @@
+import csv
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.hashing import HashingExecutor
+from user.bulk import register_users
+
+
+class Command(BaseCommand):
+    help = "Import users, each with their default organisation, from a JSON or CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSON list of user objects, or CSV with a header row")
+        parser.add_argument('--format', choices=['json', 'csv'],
+                            help="File format; guessed from the extension when omitted")
+        parser.add_argument('--chunk-size', type=int, default=settings.BULK_REGISTER_CHUNK_SIZE,
+                            help="Users written per transaction")
+        parser.add_argument('--workers', type=int, default=settings.BULK_REGISTER_WORKERS,
+                            help="Password-hashing worker processes")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in ('json', 'csv'):
+            raise CommandError("Cannot tell the file format, pass --format json or --format csv")
+
+        # A process pool of its own, sized by --workers: the command is not
+        # competing with requests, so it waits for slots instead of giving up.
+        executor = HashingExecutor(kind='process', workers=options['workers'],
+                                   max_queue=options['workers'] * 4, queue_timeout=None)
+        totals = Counter()
+        try:
+            with open(path, newline='') as f:
+                rows = json.load(f) if file_format == 'json' else csv.DictReader(f)
+                for line, result in enumerate(register_users(rows, executor, options['chunk_size']), 1):
+                    totals[result['result']] += 1
+                    if result['result'] != 'created':
+                        self.stderr.write(f"row {line} ({result['email']}): {result['result']} "
+                                          f"{json.dumps(result.get('errors', ''))}")
+        finally:
+            executor.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"created {totals['created']}, duplicate {totals['duplicate']}, invalid {totals['invalid']}"
+        ))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.organisation_cache import organisation_cache
+from core.user_cache import user_cache
+from user.models import Organisation, User
+
+
+def actual_count(column):
+    """
+    The number of membership rows whose `column` is the outer row's pk.
+    """
+    counts = (Organisation.users.through.objects
+              .filter(**{column: OuterRef('pk')}).order_by()
+              .values(column).annotate(count=Count('*')).values('count'))
+    return Coalesce(Subquery(counts), 0)
+
+
+class Command(BaseCommand):
+    help = ("Recompute Organisation.memberCount and User.organisationCount from the membership table "
+            "and fix the rows that drifted")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report the rows that drifted")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows fixed per update")
+
+    def handle(self, *args, **options):
+        fixed = self._recount(Organisation, 'memberCount', 'organisation_id', options,
+                              version=F('version') + 1)
+        self.stdout.write(f"organisations: {fixed} drifted")
+        fixed = self._recount(User, 'organisationCount', 'user_id', options)
+        self.stdout.write(f"users: {fixed} drifted")
+
+    def _recount(self, model, counter, column, options, **extra):
+        drifted = (model.objects
+                   .annotate(actual=actual_count(column))
+                   .exclude(**{counter: F('actual')})
+                   .values_list('pk', flat=True))
+        ids = list(drifted.iterator(chunk_size=options['batch_size']))
+        if options['dry_run']:
+            return len(ids)
+
+        for start in range(0, len(ids), options['batch_size']):
+            batch = ids[start:start + options['batch_size']]
+            # Counted again in the update itself, so memberships changed since
+            # the scan are not overwritten with the scanned count.
+            model.objects.filter(pk__in=batch).update(**{counter: actual_count(column)}, **extra)
+            if model is Organisation:
+                organisation_cache.invalidate(batch)
+            else:
+                for user_id in batch:
+                    user_cache.invalidate(user_id)
+        return len(ids)
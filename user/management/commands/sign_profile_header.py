@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import sign_debug_header
+
+
+class Command(BaseCommand):
+    help = "Print a signed header that makes ProfilingMiddleware profile the request it is sent with"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{settings.PROFILING['HEADER']}: {sign_debug_header()}")
+        self.stderr.write(f"valid for {settings.PROFILING['HEADER_MAX_AGE']} seconds")
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 22:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Index the membership table on (user_id, organisation_id) so that a user's
+    organisations can be read in primary-key order straight from the index,
+    which is what keyset pagination of GET /api/organisations needs. The table
+    is Django's auto-created through table, so the index is added with SQL.
+    """
+
+    dependencies = [
+        ('user', '0002_user_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX "user_organisation_users_user_org_idx" '
+                'ON "user_organisation_users" ("user_id", "organisation_id")',
+            reverse_sql='DROP INDEX "user_organisation_users_user_org_idx"',
+        ),
+    ]
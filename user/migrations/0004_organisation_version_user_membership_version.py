@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 22:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_membership_user_organisation_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organisation',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='membership_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
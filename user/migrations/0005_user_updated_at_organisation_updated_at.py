@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_organisation_version_user_membership_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organisation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
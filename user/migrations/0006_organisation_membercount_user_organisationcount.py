@@ -0,0 +1,40 @@
+# Generated by Django 5.0.6 on 2026-10-18 14:03
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_memberships(apps, schema_editor):
+    Organisation = apps.get_model('user', 'Organisation')
+    User = apps.get_model('user', 'User')
+    membership = Organisation.users.through.objects.using(schema_editor.connection.alias)
+
+    for model, column, counter in ((Organisation, 'organisation_id', 'memberCount'),
+                                   (User, 'user_id', 'organisationCount')):
+        counts = (membership.filter(**{column: OuterRef('pk')}).order_by()
+                  .values(column).annotate(count=Count('*')).values('count'))
+        model.objects.using(schema_editor.connection.alias).update(
+            **{counter: Coalesce(Subquery(counts), 0)}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0005_user_updated_at_organisation_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organisation',
+            name='memberCount',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='organisationCount',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-18 16:20
+
+import core.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0006_organisation_membercount_user_organisationcount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='organisation',
+            name='orgId',
+            field=models.UUIDField(default=core.ids.uuid7, editable=False, primary_key=True, serialize=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='userId',
+            field=models.UUIDField(default=core.ids.uuid7, editable=False, primary_key=True, serialize=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:41
+
+from django.db import migrations
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Lower
+
+
+def merge_case_duplicates(apps, schema_editor):
+    """
+    Merge the users whose emails only differ in case into one, so that the
+    case-insensitive unique constraint can be created. The active user who
+    logged in most recently is kept; the others' memberships move to them
+    and the others are deleted.
+    """
+    db = schema_editor.connection.alias
+    User = apps.get_model('user', 'User')
+    Organisation = apps.get_model('user', 'Organisation')
+    membership = Organisation.users.through
+    users = User.objects.using(db).annotate(email_lower=Lower('email'))
+
+    duplicated = list(users.values('email_lower').annotate(count=Count('pk'))
+                      .filter(count__gt=1).values_list('email_lower', flat=True))
+    for email in duplicated:
+        keeper, *duplicates = users.filter(email_lower=email).order_by(
+            '-is_active', F('last_login').desc(nulls_last=True), 'pk')
+        duplicate_ids = [user.pk for user in duplicates]
+
+        kept = set(membership.objects.using(db).filter(user_id=keeper.pk)
+                   .values_list('organisation_id', flat=True))
+        affected = set(membership.objects.using(db).filter(user_id__in=duplicate_ids)
+                       .values_list('organisation_id', flat=True))
+        membership.objects.using(db).bulk_create(
+            membership(user_id=keeper.pk, organisation_id=org_id) for org_id in affected - kept
+        )
+        User.objects.using(db).filter(pk__in=duplicate_ids).delete()
+
+        # No signals run in migrations: bring the counters and versions the
+        # membership receivers maintain up to date by hand.
+        Organisation.objects.using(db).filter(pk__in=affected).update(
+            memberCount=Coalesce(Subquery(
+                membership.objects.filter(organisation_id=OuterRef('pk')).order_by()
+                .values('organisation_id').annotate(count=Count('*')).values('count')
+            ), 0),
+            version=F('version') + 1,
+        )
+        User.objects.using(db).filter(pk=keeper.pk).update(
+            organisationCount=Coalesce(Subquery(
+                membership.objects.filter(user_id=OuterRef('pk')).order_by()
+                .values('user_id').annotate(count=Count('*')).values('count')
+            ), 0),
+            membership_version=F('membership_version') + 1,
+        )
+
+
+class Migration(migrations.Migration):
+    """
+    Runs on its own, ahead of 0009, so that the deletes are committed before
+    the unique index is built.
+    """
+
+    dependencies = [
+        ('user', '0007_user_org_uuid7_defaults'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_case_duplicates, migrations.RunPython.noop),
+    ]
@@ -3,14 +3,44 @@ import jwt
 import uuid
 from datetime import datetime, timedelta
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
+from django.db.models.signals import m2m_changed
+from django.db.models.sql import InsertQuery
+
+from core import hashing
+from core.ids import uuid7
 
 from hng_stage2.settings import *
 
 
+def _insert_sql(obj, using):
+    """
+    The INSERT statement, and its params, that saving the unsaved `obj` would
+    run, without running it.
+    """
+    meta = obj._meta
+    query = InsertQuery(type(obj))
+    query.insert_values([f for f in meta.local_concrete_fields if f is not meta.auto_field], [obj])
+    return query.get_compiler(using=using).as_sql()[0]
+
+
 # Create your models here.
 class CustomUserManager(BaseUserManager):
+    def by_email(self, email):
+        """
+        The user with `email`, ignoring case. The lookup is written as
+        LOWER(email) = %s so that it is served by the user_email_ci_unique
+        index.
+        """
+        return self.filter(Exact(Lower('email'), email.lower()))
+
+    def get_by_natural_key(self, email):
+        return self.by_email(email).get()
+
     def create_user(self, email, password=None, **extra_fields):
         if not email:
             raise ValueError('The Email field must be set')
@@ -20,6 +50,53 @@ class CustomUserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def register(self, email, password, **extra_fields):
+        """
+        Create a user together with their default organisation and membership,
+        and return (user, organisation).
+
+        The password is hashed before the database is touched. On PostgreSQL
+        the three inserts then go out as one statement, chained through
+        data-modifying CTEs; other backends run them as three inserts in one
+        transaction. No uniqueness query is made up front: a taken email
+        surfaces as the IntegrityError of the unique index. Like bulk_create,
+        this path sends no save or m2m_changed signals, so the member and
+        organisation counters are set on the rows it inserts.
+        """
+        if not email:
+            raise ValueError('The Email field must be set')
+        using = self._db or router.db_for_write(self.model)
+        user = self.model(email=self.normalize_email(email), **extra_fields)
+        user.set_password(password)
+        user.organisationCount = 1
+        organisation = Organisation.default_for(user)
+        organisation.memberCount = 1
+        membership = Organisation.users.through(organisation_id=organisation.pk, user_id=user.pk)
+
+        statements = [_insert_sql(obj, using) for obj in (user, organisation, membership)]
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            (user_sql, user_params), (organisation_sql, organisation_params), (membership_sql, membership_params) = statements
+            statements = [(
+                f'WITH new_user AS ({user_sql}), new_organisation AS ({organisation_sql}) {membership_sql}',
+                (*user_params, *organisation_params, *membership_params),
+            )]
+
+        # A single statement is atomic on its own; only take a savepoint when
+        # nested in a transaction, so a duplicate email does not break it.
+        if len(statements) > 1 or connection.in_atomic_block:
+            with transaction.atomic(using=using), connection.cursor() as cursor:
+                for sql, params in statements:
+                    cursor.execute(sql, params)
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(*statements[0])
+
+        for obj in (user, organisation):
+            obj._state.adding = False
+            obj._state.db = using
+        return user, organisation
+
     def create_superuser(self, email, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', True)
         extra_fields.setdefault('is_superuser', True)
@@ -30,32 +107,118 @@ class User(AbstractBaseUser, PermissionsMixin):
     """
     The user model
     """
-    userId = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
+    # Time-ordered, so new users append to the end of the primary key index
+    # (see core/ids.py). Rows created before 0007 keep their random keys.
+    userId = models.UUIDField(primary_key=True, default=uuid7, editable=False, unique=True)
     firstName = models.CharField(max_length=30, null=False)
     lastName = models.CharField(max_length=30, null=False)
     email = models.EmailField(unique=True, null=False, blank=False)
     phone = models.CharField(max_length=15, blank=True)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=1)
+    # Bumped whenever the user joins or leaves an organisation, or one of
+    # their organisations is deleted (see user/signals.py). Only ever written
+    # with F() updates, so save() leaves it alone.
+    membership_version = models.PositiveIntegerField(default=1)
+    # Number of organisations the user belongs to. Like membership_version it
+    # is only ever written with F() updates, by the membership receivers in
+    # user/signals.py, or set on insert by the bulk write paths.
+    organisationCount = models.PositiveIntegerField(default=0)
+    # Also touched when the user's memberships change, for incremental exports.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = CustomUserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['firstName', 'lastName']
 
+    TOKEN_LIFETIME = timedelta(hours=1)
+    # Fields carried in the token when AUTH_TOKEN_CLAIMS is enabled.
+    TOKEN_CLAIM_FIELDS = ['email', 'firstName', 'lastName', 'phone', 'is_active']
+    # Fields loaded to log a user in: the password check, a possible rehash
+    # (which bumps the version), the response and the token.
+    LOGIN_FIELDS = ['password', 'version', *TOKEN_CLAIM_FIELDS]
+
+    class Meta:
+        constraints = [
+            # Emails are unique ignoring case; the index also serves by_email().
+            models.UniqueConstraint(Lower('email'), name='user_email_ci_unique'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Every update bumps the version so claims-only tokens issued before
+        # the change can be recognised as stale.
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+            else:
+                # A full save from a cached or otherwise stale instance must
+                # not roll the membership version back. Deferred fields are
+                # left out as Django would do itself.
+                skipped = {'membership_version', 'organisationCount', *self.get_deferred_fields()}
+                kwargs['update_fields'] = [f.attname for f in self._meta.concrete_fields
+                                           if not f.primary_key and f.attname not in skipped]
+        super().save(*args, **kwargs)
+
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """
+        Same as AbstractBaseUser.check_password, but the hashing runs on the
+        password hashing pool.
+        """
+        if not hashing.check_password(raw_password, self.password):
+            return False
+        if hashing.must_update(self.password):
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return True
+
+    async def acheck_password(self, raw_password):
+        if not await hashing.acheck_password(raw_password, self.password):
+            return False
+        if hashing.must_update(self.password):
+            self.password = await hashing.amake_password(raw_password)
+            await self.asave(update_fields=['password'])
+        return True
+
     def _generate_jwt_token(self) -> str:
         """
         Generates a JSON Web Token that stores this user's ID and has an expiry
         date set to 60 days into the future.
         """
-        dt = datetime.now() + timedelta(hours=1)
+        dt = datetime.now() + self.TOKEN_LIFETIME
 
-        token = jwt.encode({
+        payload = {
             'id': str(self.pk),
             'exp': int(dt.timestamp())
-        }, SECRET_KEY, algorithm='HS256')
+        }
+        if settings.AUTH_TOKEN_CLAIMS:
+            payload.update({field: getattr(self, field) for field in self.TOKEN_CLAIM_FIELDS})
+            payload['ver'] = self.version
+
+        token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
         return token
 
+    @classmethod
+    def from_token_claims(cls, payload):
+        """
+        Build a user from the claims of a token without touching the database.
+        Every field that is not carried in the token is deferred, so it is only
+        loaded, from the database the router reads users from, if a view
+        actually reads it.
+        """
+        values = {field: payload[field] for field in cls.TOKEN_CLAIM_FIELDS}
+        values['userId'] = uuid.UUID(payload['id'])
+        values['version'] = payload['ver']
+        field_names = [f.attname for f in cls._meta.concrete_fields if f.attname in values]
+        return cls.from_db(router.db_for_read(cls), field_names, [values[name] for name in field_names])
+
     @property
     def token(self):
         """
@@ -69,10 +232,96 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 
 class Organisation(models.Model):
-    orgId = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, unique=True)
+    orgId = models.UUIDField(primary_key=True, default=uuid7, editable=False, unique=True)
     name = models.CharField(max_length=100, null=False)
     description = models.CharField(max_length=10000, blank=True)
     users = models.ManyToManyField(User, related_name='organisations')
+    # Bumped on every save and whenever memberCount changes, for the ETags of
+    # the organisation endpoints.
+    version = models.PositiveIntegerField(default=1)
+    # Number of members, maintained the same way as User.organisationCount.
+    memberCount = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            # Membership changes bump the version behind this instance's back,
+            # so it is incremented in the database rather than from the copy
+            # held here, and a full save leaves the member count alone.
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+            else:
+                skipped = {'memberCount', *self.get_deferred_fields()}
+                kwargs['update_fields'] = [f.attname for f in self._meta.concrete_fields
+                                           if not f.primary_key and f.attname not in skipped]
+        super().save(*args, **kwargs)
+        if isinstance(self.version, models.Expression):
+            self.refresh_from_db(fields=['version'])
+
+    @classmethod
+    def default_for(cls, user):
+        """
+        The (unsaved) organisation every user gets when they register.
+        """
+        return cls(
+            name=f"{user.firstName}'s Organisation",
+            description=f"Default organisation for {user.firstName} {user.lastName}"
+        )
+
+    def add_members(self, user_ids):
+        """
+        Add many users at once. The ids are resolved, together with their
+        current membership, in one query and the new memberships are written
+        with a single bulk insert. Returns a dict mapping every requested id to
+        'added', 'already-member' or 'not-found'.
+        """
+        membership = Organisation.users.through
+        requested = list(dict.fromkeys(user_ids))
+
+        existing = dict(
+            User.objects
+            .filter(userId__in=requested)
+            .annotate(is_member=models.Exists(membership.objects.filter(
+                organisation_id=self.pk, user_id=models.OuterRef('pk'),
+            )))
+            .values_list('userId', 'is_member')
+        )
+
+        results = {}
+        to_add = []
+        for user_id in requested:
+            if user_id not in existing:
+                results[user_id] = 'not-found'
+            elif existing[user_id]:
+                results[user_id] = 'already-member'
+            else:
+                results[user_id] = 'added'
+                to_add.append(user_id)
+
+        if to_add:
+            pk_set = set(to_add)
+            with transaction.atomic():
+                # bulk_create skips m2m_changed, so it is sent by hand to keep
+                # receivers that track membership in step with users.add().
+                # Like users.add(), only the ids left in pk_set after pre_add
+                # are inserted: the receiver drops those a concurrent request
+                # added first.
+                m2m_changed.send(sender=membership, action='pre_add', instance=self, reverse=False,
+                                 model=User, pk_set=pk_set, using=self._state.db)
+                for user_id in to_add:
+                    if user_id not in pk_set:
+                        results[user_id] = 'already-member'
+                membership.objects.bulk_create(
+                    [membership(organisation_id=self.pk, user_id=user_id) for user_id in to_add
+                     if user_id in pk_set],
+                    ignore_conflicts=True,
+                )
+                m2m_changed.send(sender=membership, action='post_add', instance=self, reverse=False,
+                                 model=User, pk_set=pk_set, using=self._state.db)
+
+        return results
+
@@ -0,0 +1,71 @@
+"""
+Keyset (cursor) pagination over a UUID primary key.
+
+A page is the next `limit` rows ordered by the key, strictly after the key
+encoded in the cursor, so every page costs the same index range scan however
+deep into the listing it is. Cursors are the url-safe base64 of the last key
+on the previous page and should be treated as opaque by clients.
+"""
+
+import base64
+import binascii
+import uuid
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.bytes).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        return uuid.UUID(bytes=base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise InvalidCursor(cursor)
+
+
+def _key_of(row, key):
+    if isinstance(row, dict):
+        return row[key]
+    if isinstance(row, tuple):
+        return row[0]
+    return getattr(row, key)
+
+
+def _page_query(queryset, key, after, limit):
+    """
+    The query for a page: up to `limit` + 1 rows after `after`, the extra
+    row telling whether another page follows.
+    """
+    if after is not None:
+        queryset = queryset.filter(**{f'{key}__gt': after})
+    return queryset.order_by(key)[:limit + 1]
+
+
+def _page(rows, key, limit):
+    """
+    (rows, next_cursor) from the rows fetched by a page query.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(_key_of(rows[-1], key))
+
+
+def paginate(queryset, key, after=None, limit=100):
+    """
+    Return (rows, next_cursor) for the page of `queryset` following the key
+    `after`. next_cursor is None on the last page. Works with model instances,
+    .values() dicts and .values_list() tuples whose first column is the key.
+    """
+    return _page(list(_page_query(queryset, key, after, limit)), key, limit)
+
+
+async def apaginate(queryset, key, after=None, limit=100):
+    """
+    Async counterpart of `paginate`, reading the page with async iteration.
+    """
+    return _page([row async for row in _page_query(queryset, key, after, limit)], key, limit)
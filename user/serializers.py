@@ -1,12 +1,19 @@
 import uuid
 
+from django.conf import settings
 from django.contrib.auth import authenticate
-from django.db import transaction
+from django.db import IntegrityError
 
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError, AuthenticationFailed
 
+from core import db_router
+
 from .models import User, Organisation
+from .pagination import InvalidCursor, decode_cursor
+
+
+DUPLICATE_EMAIL_MESSAGE = 'user with this email already exists.'
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -23,26 +30,29 @@ class RegisterSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['userId', 'firstName', 'lastName', 'email', 'phone', 'password', 'token']
+        # Email uniqueness is enforced by the unique index when the user is
+        # inserted (see `create`), which saves a query per registration.
+        extra_kwargs = {'email': {'validators': []}}
 
-    @transaction.atomic
     def create(self, validated_data):
-        user = User.objects.create_user(
-            email=validated_data['email'],
-            password=validated_data['password'],
-            firstName=validated_data['firstName'],
-            lastName=validated_data['lastName'],
-            phone=validated_data.get('phone', '')
-        )
-
-        # Create default organisation
-        org_name = f"{user.firstName}'s Organisation"
-        org_description = f"Default organisation for {user.firstName} {user.lastName}"
-        organisation = Organisation.objects.create(
-            name=org_name,
-            description=org_description
-        )
-        organisation.users.add(user)
-
+        try:
+            # The user, their default organisation and the membership go in
+            # together; see CustomUserManager.register.
+            user, _ = User.objects.register(
+                email=validated_data['email'],
+                password=validated_data['password'],
+                firstName=validated_data['firstName'],
+                lastName=validated_data['lastName'],
+                phone=validated_data.get('phone', '')
+            )
+        except IntegrityError as e:
+            if 'email' not in str(e):
+                raise
+            raise ValidationError({'email': [DUPLICATE_EMAIL_MESSAGE]})
+
+        # The request carried no token, so the routing middleware cannot tell
+        # who wrote: make the new user read their own rows from the primary.
+        db_router.stick(user.pk)
         return user
 
     def to_representation(self, instance):
@@ -51,10 +61,30 @@ class RegisterSerializer(serializers.ModelSerializer):
         return representation
 
 
-class LoginSerializer(serializers.Serializer):
+class BulkUserSerializer(serializers.Serializer):
+    """
+    Validates one row of a bulk registration. Email uniqueness is checked for
+    the whole chunk at once by `user.bulk.register_users`, not per row.
+    """
+    firstName = serializers.CharField(max_length=30, required=True)
+    lastName = serializers.CharField(max_length=30, required=True)
+    email = serializers.EmailField(required=True)
+    phone = serializers.CharField(max_length=15, required=True)
+    password = serializers.CharField(min_length=8, write_only=True)
+
+
+class BulkRegisterSerializer(serializers.Serializer):
+    users = serializers.ListField(child=serializers.DictField(), allow_empty=False,
+                                  max_length=settings.BULK_REGISTER_LIMIT)
+
+
+class CredentialsSerializer(serializers.Serializer):
     email = serializers.EmailField(required=True)
     password = serializers.CharField(write_only=True, required=True)
 
+
+class LoginSerializer(CredentialsSerializer):
+
     def validate(self, attrs):
         email = attrs.get('email')
         password = attrs.get('password')
@@ -82,9 +112,9 @@ class LoginSerializer(serializers.Serializer):
             'status': 'success',
             'message': 'Login successful',
             'data': {
-                'accessToken': str(token),
+                'accessToken': token,
                 'user': {
-                    'userId': str(user.userId),  # Assuming userId is UUID
+                    'userId': user.userId,
                     'firstName': user.firstName,
                     'lastName': user.lastName,
                     'email': user.email,
@@ -107,7 +137,8 @@ class OrganisationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Organisation
-        fields = ['orgId', 'name', 'description']
+        fields = ['orgId', 'name', 'description', 'memberCount']
+        read_only_fields = ['memberCount']
     
 
 class UserDetailSerializer(serializers.ModelSerializer):
@@ -115,8 +146,99 @@ class UserDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ['userId', 'firstName', 'lastName', 'email', 'phone', 'organisations']
+        fields = ['userId', 'firstName', 'lastName', 'email', 'phone', 'organisationCount', 'organisations']
+        read_only_fields = ['organisationCount']
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer for hot read paths. It never builds model instances
+    or introspects fields: `rows()` projects a queryset straight to
+    .values_list() tuples and `to_representation()`/`many()` zip those tuples
+    with the output keys.
+
+    `fields` maps each output key to the ORM lookup it is read from, in output
+    order. Extra columns passed to `rows()` come after the declared ones and
+    are ignored by `to_representation()`.
+    """
+    fields = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.keys = tuple(cls.fields)
+        cls.lookups = tuple(cls.fields.values())
+
+    @classmethod
+    def rows(cls, queryset, *extra):
+        return queryset.values_list(*cls.lookups, *extra)
+
+    @classmethod
+    def to_representation(cls, row):
+        return dict(zip(cls.keys, row))
+
+    @classmethod
+    def many(cls, rows):
+        keys = cls.keys
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class OrganisationValuesSerializer(ValuesSerializer):
+    """
+    Same output as OrganisationSerializer.
+    """
+    fields = {'orgId': 'orgId', 'name': 'name', 'description': 'description', 'memberCount': 'memberCount'}
+
+
+class UserDetailValuesSerializer(ValuesSerializer):
+    """
+    The user fields returned by GET /api/users/<id>.
+    """
+    fields = {'userId': 'userId', 'firstName': 'firstName', 'lastName': 'lastName', 'email': 'email',
+              'phone': 'phone', 'organisationCount': 'organisationCount'}
 
 
 class AddUserToOrgSerializer(serializers.Serializer):
-    userId = serializers.UUIDField(required=True)
+    userId = serializers.UUIDField(required=False)
+    userIds = serializers.ListField(child=serializers.UUIDField(), required=False, allow_empty=False,
+                                    max_length=settings.ORGANISATION_BULK_ADD_LIMIT)
+
+    def validate(self, attrs):
+        if 'userId' not in attrs and 'userIds' not in attrs:
+            raise serializers.ValidationError({'userId': 'This field is required.'})
+        return attrs
+
+
+class UserBatchSerializer(serializers.Serializer):
+    userIds = serializers.ListField(child=serializers.UUIDField(), allow_empty=False,
+                                    max_length=settings.USER_BATCH_LIMIT)
+
+
+class PageSerializer(serializers.Serializer):
+    """
+    Query parameters of a keyset-paginated listing.
+    """
+    limit = serializers.IntegerField(min_value=1, max_value=settings.PAGINATION_MAX_PAGE_SIZE,
+                                     default=settings.PAGINATION_PAGE_SIZE)
+    cursor = serializers.CharField(required=False)
+
+    def validate_cursor(self, value):
+        try:
+            return decode_cursor(value)
+        except InvalidCursor:
+            raise serializers.ValidationError('Invalid cursor.')
+
+
+class MemberPageSerializer(PageSerializer):
+    """
+    Query parameters of GET /api/organisations/<orgId>/users. With
+    `stream=true` every member after `cursor` is streamed as NDJSON instead
+    of returning one page.
+    """
+    stream = serializers.BooleanField(required=False, default=False)
+
+
+class ExportSerializer(serializers.Serializer):
+    """
+    Query parameters of GET /api/export/<table>.<format>.
+    """
+    since = serializers.DateTimeField(required=False)
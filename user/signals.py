@@ -0,0 +1,145 @@
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from core.custom_authentication import record_token_version
+from core.organisation_cache import organisation_cache
+from core.user_cache import user_cache
+
+from .models import User, Organisation
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, created=False, **kwargs):
+    """
+    Drop the authenticated-user cache entry whenever the row changes so the
+    next request sees the new state (e.g. a deactivated account), and stop
+    trusting the claims of the tokens issued before the change.
+    """
+    user_cache.invalidate(instance.pk)
+    if kwargs['signal'] is post_delete:
+        # No token of a deleted user carries a version past the last one.
+        record_token_version(instance.pk, instance.version + 1)
+    elif not created:
+        record_token_version(instance.pk, instance.version)
+
+
+def bump_membership_version(users, organisations=0):
+    """
+    Bump the membership version of `users` and add `organisations` to their
+    organisation count, in one update.
+    """
+    User.objects.filter(pk__in=users).update(
+        membership_version=F('membership_version') + 1,
+        organisationCount=F('organisationCount') + organisations,
+        updated_at=Now(),
+    )
+    for user_id in users:
+        user_cache.invalidate(user_id)
+
+
+def count_members(organisations, members):
+    """
+    Add `members` to the member count of `organisations`. Their version is
+    bumped with it, since the count is part of the organisation payload.
+    """
+    Organisation.objects.filter(pk__in=organisations).update(
+        memberCount=F('memberCount') + members,
+        version=F('version') + 1,
+    )
+    organisation_cache.invalidate(organisations)
+
+
+def lock_new_members(sender, instance, reverse, pk_set):
+    """
+    Lock the organisation and user rows of an add and drop from `pk_set`,
+    in place, the memberships a concurrent add wrote since Django looked for
+    the missing ones. The same set is what Django then inserts and reports
+    to post_add, so post_add counts exactly the rows written.
+    """
+    if reverse:
+        organisations, users, column = pk_set, [instance.pk], 'organisation_id'
+        rows = sender.objects.filter(user_id=instance.pk)
+    else:
+        organisations, users, column = [instance.pk], pk_set, 'user_id'
+        rows = sender.objects.filter(organisation_id=instance.pk)
+    # Organisations before users, each by pk, whichever side the add came
+    # from, so that concurrent adds wait on each other instead of deadlocking.
+    list(Organisation.objects.select_for_update().filter(pk__in=organisations).order_by('pk').values_list('pk'))
+    list(User.objects.select_for_update().filter(pk__in=users).order_by('pk').values_list('pk'))
+    pk_set.difference_update(rows.filter(**{f'{column}__in': pk_set}).values_list(column, flat=True))
+
+
+@receiver(m2m_changed, sender=Organisation.users.through)
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep the member and organisation counters in step with the membership
+    table, bump the membership version of every user whose set of
+    organisations changed, so the ETag of their organisation list changes
+    with it, and drop the cached payloads of the organisations involved and
+    the cached membership flags of the pairs that changed.
+
+    Changes are counted from the rows actually written, in the transaction
+    that writes them. Removals count the rows that are there before they go,
+    locked so that a concurrent removal of the same rows cannot count them
+    twice. Additions lock the organisation and user rows in pre_add and drop
+    the memberships that already exist (see lock_new_members), so that two
+    requests adding the same member cannot both count it.
+    """
+    if action == 'pre_add':
+        if pk_set:
+            lock_new_members(sender, instance, reverse, pk_set)
+        return
+    if action == 'post_add' and pk_set:
+        changed, sign = list(pk_set), 1
+    elif action in ('pre_remove', 'pre_clear'):
+        rows = sender.objects.select_for_update()
+        if reverse:
+            rows = rows.filter(user_id=instance.pk)
+            column = 'organisation_id'
+        else:
+            rows = rows.filter(organisation_id=instance.pk)
+            column = 'user_id'
+        if action == 'pre_remove':
+            if not pk_set:
+                return
+            rows = rows.filter(**{f'{column}__in': pk_set})
+        changed, sign = list(rows.values_list(column, flat=True)), -1
+    else:
+        return
+    if not changed:
+        return
+
+    if reverse:
+        # user.organisations.add/remove/clear(): `changed` are organisations.
+        bump_membership_version([instance.pk], sign * len(changed))
+        count_members(changed, sign)
+        organisation_cache.invalidate(memberships=[(org_id, instance.pk) for org_id in changed])
+    else:
+        bump_membership_version(changed, sign)
+        count_members([instance.pk], sign * len(changed))
+        organisation_cache.invalidate(memberships=[(instance.pk, user_id) for user_id in changed])
+
+
+@receiver(post_save, sender=Organisation)
+def invalidate_cached_organisation(sender, instance, **kwargs):
+    organisation_cache.invalidate([instance.pk])
+
+
+@receiver(pre_delete, sender=Organisation)
+def organisation_deleted(sender, instance, **kwargs):
+    # Deleting the organisation cascades to its membership rows without
+    # sending m2m_changed.
+    members = list(instance.users.values_list('pk', flat=True))
+    bump_membership_version(members, -1)
+    organisation_cache.invalidate([instance.pk], memberships=[(instance.pk, user_id) for user_id in members])
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Same cascade from the user's side: their organisations lose a member.
+    organisations = list(instance.organisations.values_list('pk', flat=True))
+    count_members(organisations, -1)
+    organisation_cache.invalidate(memberships=[(org_id, instance.pk) for org_id in organisations])
@@ -1,18 +1,33 @@
+import re
+import uuid
+
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from django.core.exceptions import ValidationError
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Exists, OuterRef
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 
 from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import ValidationError as DRFValidationError
 from rest_framework.exceptions import AuthenticationFailed
 
+from .bulk import register_users
+from .export import CONTENT_TYPES, TABLES as EXPORT_TABLES, encode, export_rows, gzipped, watermark
+from .etags import not_modified, organisation_etag, organisations_etag, organisations_state
+from .pagination import paginate
 from .serializers import *
-from core.exceptions import IsAuthenticatedCustom
+from core.exceptions import HashingBusyError, IsAdminCustom, IsAuthenticatedCustom, IsAuthenticatedExceptPostCustom
+from core.renderers import render_ndjson
+from core.organisation_cache import organisation_cache
 
 
+_ACCEPTS_GZIP = re.compile(r'\bgzip\b')
 
 
 @csrf_exempt
@@ -30,9 +45,9 @@ def register_user(request):
                 "status": "success",
                 "message": "Registration successful",
                 "data": {
-                    "accessToken": str(serializer.data['token']),
+                    "accessToken": serializer.data['token'],
                     "user": {
-                        "userId": str(serializer.data['userId']),
+                        "userId": serializer.data['userId'],
                         "firstName": serializer.data['firstName'],
                         "lastName": serializer.data['lastName'],
                         "email": serializer.data['email'],
@@ -48,6 +63,8 @@ def register_user(request):
         return Response({
             "errors": errors
         }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    except HashingBusyError as e:
+        return Response(e.default_detail, status=e.status_code)
     except Exception as e:
         return Response({
             "status": "Bad request",
@@ -56,6 +73,31 @@ def register_user(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([IsAdminCustom])
+def register_users_in_bulk(request):
+    """
+    Register many users at once, each with their default organisation
+    """
+    try:
+        serializer = BulkRegisterSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = list(register_users(serializer.validated_data['users']))
+
+        return Response({
+            "status": "success",
+            "message": "Bulk registration processed",
+            "data": {
+                "results": results
+            }
+        }, status=status.HTTP_200_OK)
+    except ValidationError as e:
+        errors = [{"field": k, "message": str(v[0])} for k, v in e.detail.items()]
+        return Response({
+            "errors": errors
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
 @api_view(['POST'])
 def login_user(request):
     """
@@ -78,6 +120,18 @@ def login_user(request):
         }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
 
+def shares_organisation_with(user):
+    """
+    An `Exists` expression, to annotate onto a User queryset, that is true when
+    the outer user belongs to at least one organisation `user` belongs to.
+    """
+    membership = Organisation.users.through.objects
+    return Exists(membership.filter(
+        user_id=OuterRef('pk'),
+        organisation_id__in=membership.filter(user_id=user.pk).values('organisation_id'),
+    ))
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedCustom])
 def get_user_detail(request, id):
@@ -85,32 +139,85 @@ def get_user_detail(request, id):
     Get a user's own record or user record in organisations they belong to or created
     """
     # Check if the requesting user is trying to access their own record
-    print(request.user.userId)
-    print(id)
     if str(request.user.userId) == id:
+        # Read straight off the authenticated user so that a claims-only
+        # token is served without touching the database. Such a token
+        # carries every field but organisationCount, which changes too often
+        # to be put in a token, so the count is only included when the user
+        # was loaded from the database or the user cache.
         user = request.user
+        deferred = user.get_deferred_fields()
+        data = {field: getattr(user, field) for field in UserDetailValuesSerializer.keys if field not in deferred}
     else:
-        # Check if the requested user is in the same organization as the requesting user
-        user = get_object_or_404(User, userId=id)
-        requesting_user_orgs = request.user.organisations.all()
-        if not user.organisations.filter(orgId__in=requesting_user_orgs.values_list('orgId', flat=True)).exists():
+        # Existence, the shared-organisation check and the projected fields
+        # all come back from a single query.
+        try:
+            row = UserDetailValuesSerializer.rows(
+                User.objects.filter(userId=id).annotate(shares_organisation=shares_organisation_with(request.user)),
+                'shares_organisation'
+            ).first()
+        except DjangoValidationError:
+            row = None
+        if row is None:
+            raise Http404
+        data = UserDetailValuesSerializer.to_representation(row)
+        if not row[-1]:
             return Response({
                 "status": "error",
                 "message": "You do not have permission to view this user's details",
                 "statusCode": 403
             }, status=status.HTTP_403_FORBIDDEN)
 
-    serializer = UserDetailSerializer(user)
+    return Response({
+        "status": "success",
+        "message": "<message>",
+        "data": data
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticatedCustom])
+def get_user_details(request):
+    """
+    Get the records of up to USER_BATCH_LIMIT users, sent as `userIds`, in one
+    request. Users are returned in the order asked for; a user that does not
+    exist or shares no organisation with the requesting user is returned as
+    `{"userId": ..., "error": "not_found" | "forbidden"}` instead.
+    """
+    serializer = UserBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        errors = [{"field": k, "message": str(v[0])} for k, v in serializer.errors.items()]
+        return Response({
+            "errors": errors
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    user_ids = list(dict.fromkeys(serializer.validated_data['userIds']))
+
+    # Every user and whether they share an organisation with the requesting
+    # user come back from a single query, however many ids were asked for.
+    rows = {
+        row[0]: row
+        for row in UserDetailValuesSerializer.rows(
+            User.objects.filter(userId__in=user_ids).annotate(shares_organisation=shares_organisation_with(request.user)),
+            'shares_organisation'
+        )
+    }
+
+    users = []
+    for user_id in user_ids:
+        row = rows.get(user_id)
+        if row is None:
+            users.append({"userId": user_id, "error": "not_found"})
+        elif row[-1] or user_id == request.user.pk:
+            users.append(UserDetailValuesSerializer.to_representation(row))
+        else:
+            users.append({"userId": user_id, "error": "forbidden"})
 
     return Response({
         "status": "success",
         "message": "<message>",
         "data": {
-            "userId": str(serializer.data['userId']),
-            "firstName": serializer.data['firstName'],
-            "lastName": serializer.data['lastName'],
-            "email": serializer.data['email'],
-            "phone": serializer.data['phone'],
+            "users": users
         }
     }, status=status.HTTP_200_OK)
 
@@ -119,26 +226,39 @@ def get_user_detail(request, id):
 @permission_classes([IsAuthenticatedCustom])
 def get_user_organisations(request):
     """
-    Get all organisations the authenticated user belongs to or created.
+    Get the organisations the authenticated user belongs to or created, one
+    page at a time. Pass the returned `nextCursor` as `cursor` to get the next page.
     """
     if request.method == 'GET':
+        page = PageSerializer(data=request.query_params)
+        if not page.is_valid():
+            errors = [{"field": k, "message": str(v[0])} for k, v in page.errors.items()]
+            return Response({
+                "errors": errors
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
         try:
-            # Get organisations the user belongs to
-            user_organisations = request.user.organisations.all()
+            cursor, limit = page.validated_data.get('cursor'), page.validated_data['limit']
 
-            # Combine and remove duplicates
-            all_organisations = user_organisations
+            # Answer a poll for an unchanged list from the version counters alone
+            etag = organisations_etag(request.user, organisations_state(request.user).first(), cursor, limit)
+            if not_modified(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
 
-            # Serialize the data
-            serializer = OrganisationSerializer(all_organisations, many=True)
+            # Get a page of the organisations the user belongs to
+            user_organisations, next_cursor = paginate(
+                OrganisationValuesSerializer.rows(request.user.organisations.all()), 'orgId',
+                after=cursor, limit=limit
+            )
 
             return Response({
                 "status": "success",
                 "message": "<message>",
                 "data": {
-                    "organisations": serializer.data
+                    "organisations": OrganisationValuesSerializer.many(user_organisations),
+                    "nextCursor": next_cursor
                 }
-            }, status=status.HTTP_200_OK)
+            }, status=status.HTTP_200_OK, headers={'ETag': etag})
 
         except Exception as e:
             return Response({
@@ -158,6 +278,7 @@ def get_user_organisations(request):
 
                 # Add the user to the organisation
                 organisation.users.add(request.user)
+                organisation.refresh_from_db(fields=['memberCount'])
 
                 return Response({
                     "status": "success",
@@ -178,6 +299,74 @@ def get_user_organisations(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 
+def parse_org_id(org_id):
+    """
+    The orgId from the URL as a UUID, so cache keys are the same whatever
+    form the client wrote it in. Raises Organisation.DoesNotExist for
+    anything that is not a UUID.
+    """
+    try:
+        return uuid.UUID(org_id)
+    except ValueError:
+        raise Organisation.DoesNotExist
+
+
+def load_organisation(org_id):
+    """
+    (version, serialized payload) of the organisation, or None.
+    """
+    row = OrganisationValuesSerializer.rows(Organisation.objects.filter(orgId=org_id), 'version').first()
+    return None if row is None else (row[-1], OrganisationValuesSerializer.to_representation(row))
+
+
+def membership(org_id, user_id):
+    """
+    The membership row of `user_id` in the organisation, as a queryset, for an
+    EXISTS on the (organisation_id, user_id) index.
+    """
+    return Organisation.users.through.objects.filter(organisation_id=org_id, user_id=user_id)
+
+
+def cached_organisation(request, org_id):
+    """
+    ((version, payload), is member) of the organisation for the requesting
+    user, from the organisation cache when possible. Raises
+    Organisation.DoesNotExist when there is no such organisation.
+    """
+    return cached_payload(request, org_id), cached_membership(request, org_id)
+
+
+def cached_payload(request, org_id):
+    """
+    (version, payload) of the organisation, from the organisation cache when
+    possible. Raises Organisation.DoesNotExist when there is no such
+    organisation.
+    """
+    entry = organisation_cache.organisation(org_id, lambda: load_organisation(org_id),
+                                            request.resolver_match.view_name)
+    if entry is None:
+        raise Organisation.DoesNotExist
+    return entry
+
+
+def cached_membership(request, org_id):
+    """
+    Whether the requesting user is a member of the organisation, from the
+    organisation cache when possible.
+    """
+    user_id = request.user.pk
+    return organisation_cache.is_member(org_id, user_id, lambda: membership(org_id, user_id).exists(),
+                                        request.resolver_match.view_name)
+
+
+def forbidden_organisation_response():
+    return Response({
+        "status": "error",
+        "message": "You do not have permission to view this organisation",
+        "statusCode": 403
+    }, status=status.HTTP_403_FORBIDDEN)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedCustom])
 def get_single_organisation(request, orgId):
@@ -185,25 +374,24 @@ def get_single_organisation(request, orgId):
     Get a single organisation record for the authenticated user.
     """
     try:
-        # Attempt to get the organisation
-        organisation = get_object_or_404(Organisation, orgId=orgId)
+        org_id = parse_org_id(orgId)
+
+        # The serialized organisation and its members, from the cache when possible
+        (version, data), is_member = cached_organisation(request, org_id)
 
         # Check if the user is associated with this organisation
-        if not request.user.organisations.filter(orgId=orgId).exists():
-            return Response({
-                "status": "error",
-                "message": "You do not have permission to view this organisation",
-                "statusCode": 403
-            }, status=status.HTTP_403_FORBIDDEN)
+        if not is_member:
+            return forbidden_organisation_response()
 
-        # Serialize the data
-        serializer = OrganisationSerializer(organisation)
+        etag = organisation_etag(org_id, version)
+        if not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
 
         return Response({
             "status": "success",
             "message": "<message>",
-            "data": serializer.data
-        }, status=status.HTTP_200_OK)
+            "data": data
+        }, status=status.HTTP_200_OK, headers={'ETag': etag})
 
     except Organisation.DoesNotExist:
         return Response({
@@ -220,11 +408,86 @@ def get_single_organisation(request, orgId):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-@api_view(['POST'])
+def list_organisation_users(request, orgId):
+    """
+    Get the members of an organisation the authenticated user belongs to, one
+    page at a time, or every member after `cursor` as NDJSON with `stream=true`.
+    """
+    page = MemberPageSerializer(data=request.query_params)
+    if not page.is_valid():
+        errors = [{"field": k, "message": str(v[0])} for k, v in page.errors.items()]
+        return Response({
+            "errors": errors
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    try:
+        org_id = parse_org_id(orgId)
+        # Members only need their membership flag; the organisation is only
+        # looked up for everyone else, to tell a 404 from a 403.
+        if not cached_membership(request, org_id):
+            cached_payload(request, org_id)
+            return forbidden_organisation_response()
+    except Organisation.DoesNotExist:
+        return Response({
+            "status": "error",
+            "message": "Organisation not found",
+            "statusCode": 404
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    members = User.objects.filter(organisations=org_id)
+    cursor = page.validated_data.get('cursor')
+
+    if page.validated_data['stream']:
+        # Rows are fetched chunk by chunk (through a server-side cursor on
+        # PostgreSQL) while the response is being sent.
+        if cursor is not None:
+            members = members.filter(userId__gt=cursor)
+        rows = UserDetailValuesSerializer.rows(members.order_by('userId'))
+        return StreamingHttpResponse(
+            render_ndjson(map(UserDetailValuesSerializer.to_representation,
+                              rows.iterator(chunk_size=settings.STREAMING_CHUNK_SIZE))),
+            content_type='application/x-ndjson'
+        )
+
+    users, next_cursor = paginate(UserDetailValuesSerializer.rows(members), 'userId',
+                                  after=cursor, limit=page.validated_data['limit'])
+    return Response({
+        "status": "success",
+        "message": "<message>",
+        "data": {
+            "users": UserDetailValuesSerializer.many(users),
+            "nextCursor": next_cursor
+        }
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticatedExceptPostCustom])
 def add_user_to_organisation(request, orgId):
     """
-    Add a user to a particular organisation
+    Add a user, or a list of users sent as `userIds`, to a particular organisation.
+    GET lists the organisation's members (see `list_organisation_users`).
+
+    Adding a single user is open, as it always was; adding a list of users
+    is reserved to authenticated members of the organisation.
     """
+    if request.method == 'GET':
+        return list_organisation_users(request, orgId)
+
+    if 'userIds' in request.data:
+        IsAuthenticatedCustom().has_permission(request, add_user_to_organisation)
+        try:
+            org_id = parse_org_id(orgId)
+            if not cached_membership(request, org_id):
+                cached_payload(request, org_id)
+                return forbidden_organisation_response()
+        except Organisation.DoesNotExist:
+            return Response({
+                "status": "error",
+                "message": "Organisation not found",
+                "statusCode": 404
+            }, status=status.HTTP_404_NOT_FOUND)
+
     try:
         # Get the organisation
         organisation = get_object_or_404(Organisation, orgId=orgId)
@@ -232,11 +495,22 @@ def add_user_to_organisation(request, orgId):
         # Validate the request data
         serializer = AddUserToOrgSerializer(data=request.data)
         if serializer.is_valid(raise_exception=True):
+            if 'userIds' in serializer.validated_data:
+                results = organisation.add_members(serializer.validated_data['userIds'])
+
+                return Response({
+                    "status": "success",
+                    "message": "Users processed",
+                    "data": {
+                        "results": [{"userId": user_id, "result": result}
+                                    for user_id, result in results.items()]
+                    }
+                }, status=status.HTTP_200_OK)
+
             userid = serializer.validated_data['userId']
 
             # Get the user to be added
             user_to_add = get_object_or_404(User, userId=userid)
-            print(user_to_add)
 
             # Check if the user is already in the organisation
             if organisation.users.filter(userId=user_to_add.userId).exists():
@@ -267,3 +541,40 @@ def add_user_to_organisation(request, orgId):
             "message": "Client error",
             "statusCode": 400
         }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminCustom])
+def export_table(request, table, file_format):
+    """
+    Stream a whole table (users, organisations or memberships) as NDJSON or
+    CSV, or only the rows changed since the `since` watermark, gzipped when
+    the client accepts it. The watermark for the next incremental export is
+    sent back in the X-Export-Watermark header.
+
+    The rows are read while the response is sent; the routing and timing
+    middlewares stay active until then (see core.middleware).
+    """
+    if table not in EXPORT_TABLES or file_format not in CONTENT_TYPES:
+        raise Http404
+
+    params = ExportSerializer(data=request.query_params)
+    if not params.is_valid():
+        errors = [{"field": k, "message": str(v[0])} for k, v in params.errors.items()]
+        return Response({
+            "errors": errors
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    next_watermark = watermark()
+    columns, rows = export_rows(table, since=params.validated_data.get('since'))
+    chunks = encode(columns, rows, file_format)
+    compress = bool(_ACCEPTS_GZIP.search(request.headers.get('Accept-Encoding', '')))
+
+    response = StreamingHttpResponse(gzipped(chunks) if compress else chunks,
+                                     content_type=CONTENT_TYPES[file_format])
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept-Encoding'
+    response['Content-Disposition'] = f'attachment; filename="{table}.{file_format}"'
+    response['X-Export-Watermark'] = next_watermark.isoformat()
+    return response